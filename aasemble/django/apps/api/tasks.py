@@ -1,10 +1,21 @@
 from celery import shared_task
 
 from aasemble.django.apps.buildsvc import models as buildsvc_models
-from aasemble.django.apps.buildsvc import tasks as buildsvc_tasks
 
 
 @shared_task(ignore_result=True)
-def github_push_event(url):
-    for ps in buildsvc_models.PackageSource.objects.filter(git_url=url):
-        buildsvc_tasks.poll_one.delay(ps.id)
+def github_push_event(url, ref=None, sha=None):
+    if not ref or not sha:
+        # We don't know what was pushed, so poll everything from this repo
+        for ps in buildsvc_models.PackageSource.lookup_by_git_url(url):
+            ps.schedule_poll()
+        return
+
+    # Tag pushes and branch deletions don't give us anything to build
+    if not ref.startswith('refs/heads/') or not sha.strip('0'):
+        return
+
+    branch = ref[len('refs/heads/'):]
+    for ps in buildsvc_models.PackageSource.lookup_by_git_url(url).filter(branch=branch):
+        if ps.record_revision(sha):
+            ps.build(sha, priority=buildsvc_models.BuildRequest.WEBHOOK)
@@ -1,4 +1,8 @@
 import os.path
+import shutil
+import tempfile
+
+from django.test import override_settings
 
 import mock
 
@@ -75,7 +79,9 @@ class APIv1RepositoryTests(APIv1Tests):
                            'self': response.data['self'],
                            'sources': response.data['self'] + 'sources/',
                            'user': 'eric',
-                           'key_id': u''}
+                           'key_id': u'',
+                           'build_retention_count': None,
+                           'build_retention_days': None}
 
         self.assertEquals(response.data, expected_result)
         response = self.client.get(response.data['self'])
@@ -116,7 +122,9 @@ class APIv1RepositoryTests(APIv1Tests):
                            'self': response.data['self'],
                            'sources': response.data['self'] + 'sources/',
                            'user': 'eric',
-                           'key_id': u''}
+                           'key_id': u'',
+                           'build_retention_count': None,
+                           'build_retention_days': None}
 
         self.assertEquals(response.data, expected_result)
 
@@ -208,10 +216,79 @@ class APIv1BuildTests(APIv1Tests):
         self.assertEquals(response.status_code, 200)
         self.assertEquals(response.data['count'], 10)
 
+    def test_build_queue(self):
+        authenticate(self.client, 'eric')
+        response = self.client.get(self.list_url + 'queue/')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['queued'], 0)
+        self.assertEquals(len(response.data['repositories']), 7)
+
+    def build_url(self, build):
+        return '%s%s/' % (self.list_url, build.id)
+
+    def test_build_log(self):
+        from aasemble.django.apps.buildsvc.models import BuildRecord
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        build = BuildRecord.objects.filter(source__series__repository__user__username='eric').first()
+
+        authenticate(self.client, 'eric')
+        with override_settings(BUILDSVC_REPOS_BASE_PUBLIC_DIR=tmpdir):
+            with open(build.buildlog(), 'wb') as fp:
+                fp.write(b'line one\nline two\n')
+
+            response = self.client.get(self.build_url(build) + 'log/')
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(response.data, {'offset': 0, 'next_offset': 18,
+                                              'data': 'line one\nline two\n', 'complete': True})
+
+            response = self.client.get(self.build_url(build) + 'log/?offset=9')
+            self.assertEquals(response.data['data'], 'line two\n')
+
+            response = self.client.get(self.build_url(build) + 'log/?offset=foo')
+            self.assertEquals(response.status_code, 400)
+
+            response = self.client.get(self.build_url(build) + 'log/', HTTP_ACCEPT='text/event-stream',
+                                       HTTP_LAST_EVENT_ID='9')
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(response['Content-Type'], 'text/event-stream')
+            self.assertEquals(b''.join(response.streaming_content),
+                              b'id: 18\ndata: line two\n\nevent: complete\ndata: \n\n')
+
+    def test_build_log_other_user(self):
+        from aasemble.django.apps.buildsvc.models import BuildRecord
+        build = BuildRecord.objects.filter(source__series__repository__user__username='eric').first()
+        authenticate(self.client, 'aaron')
+        response = self.client.get(self.build_url(build) + 'log/')
+        self.assertEquals(response.status_code, 404)
+
+    def test_build_phases(self):
+        from aasemble.django.apps.buildsvc.models import BuildPhase, BuildRecord
+        build = BuildRecord.objects.filter(source__series__repository__user__username='eric').first()
+        with build.phase(BuildPhase.EXPORT):
+            pass
+
+        authenticate(self.client, 'eric')
+        response = self.client.get(self.list_url + 'phases/')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(len(response.data), 7)
+        phases = [r['phases'] for r in response.data if r['phases']]
+        self.assertEquals(len(phases), 1)
+        self.assertEquals(phases[0]['export']['count'], 1)
+
+        response = self.client.get(self.list_url)
+        build_data = [b for b in response.data['results'] if b['phases']]
+        self.assertEquals(len(build_data), 1)
+        self.assertEquals(build_data[0]['phases'][0]['name'], 'export')
+        self.assertTrue(build_data[0]['phases'][0]['succeeded'])
+
 
 class APIv2BuildTests(APIv1BuildTests):
     list_url = '/api/v2/builds/'
 
+    def build_url(self, build):
+        return '%s%s/' % (self.list_url, build.uuid)
+
     def test_builds_default_order(self):
         authenticate(self.client, 'eric')
         response = self.client.get(self.list_url)
@@ -292,6 +369,14 @@ class APIv1SourceTests(APIv1Tests):
         self.assertEquals(response.data, data)
         return response.data
 
+    @mock.patch('aasemble.django.apps.buildsvc.tasks.dispatch_builds')
+    def test_build_source(self, dispatch_builds):
+        source = self.test_create_source()
+        response = self.client.post(source['self'] + 'build/')
+        self.assertEquals(response.data['status'], 'build scheduled')
+        response = self.client.post(source['self'] + 'build/')
+        self.assertEquals(response.data['status'], 'build already scheduled')
+
     def test_delete_source(self):
         source = self.test_create_source()
 
@@ -492,7 +577,9 @@ class GithubHookViewTestCase(APIv1Tests):
                                    content_type='application/json',
                                    HTTP_X_GITHUB_EVENT='push')
         self.assertEquals(res.data, {'ok': 'thanks'})
-        github_push_event.delay.assert_called_with("https://github.com/baxterthehacker/public-repo")
+        github_push_event.delay.assert_called_with("https://github.com/baxterthehacker/public-repo",
+                                                   "refs/heads/changes",
+                                                   "0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c")
 
     @mock.patch('aasemble.django.apps.buildsvc.tasks.poll_one')
     def test_github_push_event(self, poll_one):
@@ -500,6 +587,46 @@ class GithubHookViewTestCase(APIv1Tests):
         github_push_event("https://github.com/eric/project0")
         poll_one.delay.assert_called_with(1)
 
+    @mock.patch('aasemble.django.apps.buildsvc.tasks.poll_one')
+    @mock.patch('aasemble.django.apps.buildsvc.tasks.dispatch_builds')
+    def test_github_push_event_builds_pushed_sha(self, dispatch_builds, poll_one):
+        from .tasks import github_push_event
+        from aasemble.django.apps.buildsvc.models import BuildRequest, PackageSource
+
+        github_push_event("https://github.com/eric/project0", "refs/heads/master",
+                          "0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c")
+
+        req = BuildRequest.objects.get(source_id=1)
+        self.assertEquals(req.sha, "0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c")
+        self.assertEquals(req.priority, BuildRequest.WEBHOOK)
+        self.assertFalse(poll_one.delay.called)
+        self.assertEquals(PackageSource.objects.get(id=1).last_seen_revision,
+                          "0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c")
+
+    @mock.patch('aasemble.django.apps.buildsvc.tasks.dispatch_builds')
+    def test_github_push_event_url_variant(self, dispatch_builds):
+        from .tasks import github_push_event
+        from aasemble.django.apps.buildsvc.models import BuildRequest
+        github_push_event("http://github.com/Eric/project0.git", "refs/heads/master",
+                          "0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c")
+        self.assertEquals(BuildRequest.objects.get(source_id=1).sha, "0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c")
+
+    @mock.patch('aasemble.django.apps.buildsvc.tasks.poll_one')
+    def test_github_push_event_other_branch(self, poll_one):
+        from .tasks import github_push_event
+        from aasemble.django.apps.buildsvc.models import BuildRequest
+        github_push_event("https://github.com/eric/project0", "refs/heads/other",
+                          "0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c")
+        self.assertFalse(BuildRequest.objects.exists())
+        self.assertFalse(poll_one.delay.called)
+
+    def test_github_push_event_branch_deleted(self):
+        from .tasks import github_push_event
+        from aasemble.django.apps.buildsvc.models import BuildRequest
+        github_push_event("https://github.com/eric/project0", "refs/heads/master",
+                          "0000000000000000000000000000000000000000")
+        self.assertFalse(BuildRequest.objects.exists())
+
 
 class APIv1MirrorsetTests(APIv1Tests):
     list_url = '/api/v1/mirror_sets/'
@@ -99,13 +99,24 @@ class SeriesSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('self', 'name', 'repository', 'binary_source_list', 'source_source_list')
 
 
+class BuildPhaseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = buildsvc_models.BuildPhase
+        fields = ('name', 'started', 'duration', 'succeeded', 'artifact_bytes')
+
+
 class BuildRecordSerializer(serializers.HyperlinkedModelSerializer):
     self = serializers.HyperlinkedRelatedField(view_name='v1_buildrecord-detail', read_only=True, source='*')
     source = serializers.HyperlinkedRelatedField(view_name='v1_packagesource-detail', read_only=True)
+    phases = BuildPhaseSerializer(many=True, read_only=True)
+    buildlog_url = serializers.SerializerMethodField()
 
     class Meta:
         model = buildsvc_models.BuildRecord
-        fields = ('self', 'source', 'version', 'build_started', 'sha', 'buildlog_url')
+        fields = ('self', 'source', 'version', 'build_started', 'sha', 'status', 'buildlog_url', 'phases')
+
+    def get_buildlog_url(self, obj):
+        return self.context['request'].build_absolute_uri(obj.buildlog_url())
 
 
 class ExternalDependencySerializer(serializers.HyperlinkedModelSerializer):
@@ -137,4 +148,5 @@ class RepositorySerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = buildsvc_models.Repository
-        fields = ('self', 'user', 'name', 'key_id', 'sources', 'binary_source_list', 'source_source_list', 'external_dependencies')
+        fields = ('self', 'user', 'name', 'key_id', 'sources', 'binary_source_list', 'source_source_list', 'external_dependencies',
+                  'build_retention_count', 'build_retention_days')
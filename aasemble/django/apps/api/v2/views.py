@@ -7,14 +7,17 @@ import django.db.utils
 from rest_auth.registration.views import SocialLoginView
 
 from rest_framework import filters, mixins, viewsets
-from rest_framework.decorators import detail_route
+from rest_framework.decorators import detail_route, list_route
 from rest_framework.response import Response
 
 from aasemble.django.apps.buildsvc import models as buildsvc_models
+from aasemble.django.apps.buildsvc.scheduler import queue_stats
+from aasemble.django.apps.buildsvc.stats import phase_stats
 from aasemble.django.apps.mirrorsvc import models as mirrorsvc_models
 from aasemble.django.exceptions import DuplicateResourceException
 
 from . import serializers
+from ..views import BuildLogMixin
 
 
 class GithubLogin(SocialLoginView):
@@ -132,6 +135,15 @@ class PackageSourceViewSet(viewsets.ModelViewSet):
 
         return qs
 
+    @detail_route(methods=['post'])
+    def build(self, request, **kwargs):
+        source = self.get_object()
+        if source.build(priority=buildsvc_models.BuildRequest.MANUAL):
+            status = 'build scheduled'
+        else:
+            status = 'build already scheduled'
+        return Response({'status': status})
+
 
 class ExternalDependencyViewSet(viewsets.ModelViewSet):
     """
@@ -152,11 +164,11 @@ class ExternalDependencyViewSet(viewsets.ModelViewSet):
         return qs
 
 
-class BuildViewSet(viewsets.ReadOnlyModelViewSet):
+class BuildViewSet(BuildLogMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows builds viewed
     """
-    queryset = buildsvc_models.BuildRecord.objects.all()
+    queryset = buildsvc_models.BuildRecord.objects.prefetch_related('phases')
     serializer_class = serializers.BuildRecordSerializer
     filter_backends = (filters.OrderingFilter,)
     ordering = ('build_started',)
@@ -171,3 +183,11 @@ class BuildViewSet(viewsets.ReadOnlyModelViewSet):
                 qs = qs.filter(source__uuid=kwargs['source_uuid'])
 
         return qs
+
+    @list_route()
+    def queue(self, request, **kwargs):
+        return Response(queue_stats(buildsvc_models.Repository.lookup_by_user(request.user)))
+
+    @list_route()
+    def phases(self, request, **kwargs):
+        return Response(phase_stats(buildsvc_models.Repository.lookup_by_user(request.user)))
@@ -3,10 +3,17 @@ import logging
 from allauth.account.adapter import DefaultAccountAdapter
 
 from django.conf import settings
+from django.http import StreamingHttpResponse
 
+from rest_framework.decorators import detail_route
+from rest_framework.exceptions import ParseError
 from rest_framework.generics import CreateAPIView
 from rest_framework.permissions import AllowAny
+from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from aasemble.django.apps.buildsvc.buildlog import LogTail, sse_events
 
 LOG = logging.getLogger(__name__)
 
@@ -34,8 +41,50 @@ class GithubHookView(CreateAPIView):
             if event_type != 'push':
                 return Response({'thanks': 'cool story bro'})
 
-            github_push_event.delay(url)
+            github_push_event.delay(url, request.data.get('ref'), request.data.get('after'))
 
             return Response({'ok': 'thanks'})
         except KeyError:
             return Response({"it's not me": "it's you"})
+
+
+class EventStreamRenderer(BaseRenderer):
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only used to negotiate streaming, which doesn't go through here
+        return b''
+
+
+class BuildLogMixin(object):
+    """Lets clients tail the log of a build
+
+    GET log/?offset=N returns what has been written from byte N onwards,
+    along with the offset to ask for next time. With wait=S, waits up to S
+    seconds for something new to turn up (long polling). Clients accepting
+    text/event-stream get a stream of server-sent events instead."""
+
+    @detail_route(renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES + [EventStreamRenderer])
+    def log(self, request, **kwargs):
+        build = self.get_object()
+        try:
+            offset = int(request.query_params.get('offset', request.META.get('HTTP_LAST_EVENT_ID', 0)))
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            raise ParseError('offset and wait must be numbers')
+
+        tail = LogTail(build, offset)
+        start = tail.offset
+
+        if request.accepted_renderer.format == 'sse':
+            timeout = getattr(settings, 'BUILDSVC_LOG_STREAM_TIMEOUT', 300)
+            response = StreamingHttpResponse(sse_events(tail, timeout), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+        data = tail.wait(min(max(wait, 0), getattr(settings, 'BUILDSVC_LOG_POLL_TIMEOUT', 30)))
+        return Response({'offset': start,
+                         'next_offset': tail.offset,
+                         'data': data.decode('utf-8', 'replace'),
+                         'complete': tail.complete})
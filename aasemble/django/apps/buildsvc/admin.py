@@ -5,4 +5,5 @@ from . import models
 admin.site.register(models.Repository)
 admin.site.register(models.Series)
 admin.site.register(models.PackageSource)
+admin.site.register(models.BuildRequest)
 admin.site.register(models.GithubRepository)
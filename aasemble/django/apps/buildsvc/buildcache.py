@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import os.path
+import shutil
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .gitcache import directory_size
+
+LOG = logging.getLogger(__name__)
+
+STATS = ('hits', 'misses', 'stores', 'evictions')
+
+
+def build_cache_key(*parts):
+    """Hash a number of build inputs (strings, or lists of strings) into a key"""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (list, tuple)):
+            part = '\n'.join(part)
+        h.update((part or '').encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class BuildCache(object):
+    """Artifacts of earlier builds, keyed by everything that went into them
+
+    An entry holds the source and binary packages and .changes files of a
+    build, along with the version they were built as. The least recently
+    used entries are evicted once the cache grows beyond its disk budget."""
+
+    META = 'meta.json'
+
+    def __init__(self, basedir=None, max_bytes=None):
+        if basedir is None:
+            basedir = settings.BUILDSVC_BUILD_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = getattr(settings, 'BUILDSVC_BUILD_CACHE_MAX_BYTES', 20 * 1024 ** 3)
+        self.basedir = basedir
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.basedir, key)
+
+    def lookup(self, key):
+        """Returns the metadata of the entry for key, or None"""
+        try:
+            with open(os.path.join(self.path(key), self.META), 'r') as fp:
+                meta = json.load(fp)
+        except (IOError, OSError, ValueError):
+            self.count('misses')
+            return None
+
+        self.count('hits')
+        return meta
+
+    def restore(self, key, dest):
+        """Copy the artifacts of the entry for key into dest"""
+        path = self.path(key)
+        for f in os.listdir(path):
+            if f != self.META:
+                shutil.copy2(os.path.join(path, f), dest)
+
+        # The mtime of the entry is what LRU eviction goes by
+        os.utime(path, None)
+
+    def store(self, key, srcdir, files, **meta):
+        """Add the given files from srcdir to the cache under key"""
+        path = self.path(key)
+        if os.path.isdir(path):
+            return
+
+        tmppath = '%s.tmp.%d' % (path, os.getpid())
+        if os.path.isdir(tmppath):
+            shutil.rmtree(tmppath)
+        os.makedirs(tmppath)
+
+        for f in files:
+            shutil.copy2(os.path.join(srcdir, f), tmppath)
+        with open(os.path.join(tmppath, self.META), 'w') as fp:
+            json.dump(meta, fp)
+
+        try:
+            os.rename(tmppath, path)
+        except OSError:
+            # Someone else stored the same build in the meantime
+            shutil.rmtree(tmppath)
+            return
+
+        self.count('stores')
+        self.evict(keep=path)
+
+    def entries(self):
+        if not os.path.isdir(self.basedir):
+            return []
+        return [os.path.join(self.basedir, d) for d in os.listdir(self.basedir)
+                if '.tmp.' not in d and os.path.isdir(os.path.join(self.basedir, d))]
+
+    def size(self):
+        return sum(directory_size(path) for path in self.entries())
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until we're within budget
+
+        Returns the number of bytes freed."""
+        entries = [(os.path.getmtime(path), path, directory_size(path)) for path in self.entries()]
+        total = sum(size for mtime, path, size in entries)
+
+        freed = 0
+        for mtime, path, size in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            LOG.info('Evicting %s from build cache (%d bytes)' % (path, size))
+            shutil.rmtree(path, ignore_errors=True)
+            freed += size
+            self.count('evictions')
+
+        return freed
+
+    def count(self, stat):
+        key = 'buildsvc_build_cache_%s' % (stat,)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+    def stats(self):
+        stats = dict((stat, cache.get('buildsvc_build_cache_%s' % (stat,), 0)) for stat in STATS)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+        stats['entries'] = len(self.entries())
+        stats['size'] = self.size()
+        stats['max_size'] = self.max_bytes
+        return stats
+
+
+def get_build_cache():
+    if getattr(settings, 'BUILDSVC_BUILD_CACHE_DIR', None):
+        return BuildCache()
+    return None
@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import os
+import os.path
+import shutil
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .depresolver import package_names
+from .gitcache import file_lock
+from ...exceptions import CommandFailed
+from ...utils import run_cmd
+
+LOG = logging.getLogger(__name__)
+
+
+class BuilderImages(object):
+    """Docker images with build dependencies installed ahead of time
+
+    Images are derived from a base image and named after a hash of the
+    base image, the sorted build dependencies and the external dependency
+    keys and repos, so builds with the same dependencies share an image
+    and skip installing them. Least recently used images are removed once
+    they take up more than the disk budget."""
+
+    def __init__(self, repository=None, workdir=None, max_bytes=None):
+        if repository is None:
+            repository = settings.BUILDSVC_BUILDER_IMAGE_REPOSITORY
+        if workdir is None:
+            workdir = getattr(settings, 'BUILDSVC_BUILDER_IMAGE_DIR',
+                              os.path.join(settings.BUILDSVC_REPOS_BASE_DIR, '.builder-images'))
+        if max_bytes is None:
+            max_bytes = getattr(settings, 'BUILDSVC_BUILDER_IMAGE_MAX_BYTES', 20 * 1024 ** 3)
+        self.repository = repository
+        self.workdir = workdir
+        self.max_bytes = max_bytes
+        self.apt_proxy = (getattr(settings, 'BUILDSVC_APT_PROXY_URL', None) or '').rstrip('/')
+
+    def tag(self, base_image, packages, keys='', repos=''):
+        h = hashlib.sha256()
+        for part in [base_image, keys, repos, self.apt_proxy] + sorted(set(packages)):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()[:32]
+
+    # docker image inspect needs docker 1.13, docker inspect --type=image doesn't
+    def exists(self, image):
+        try:
+            run_cmd(['docker', 'inspect', '--type=image', image], discard_stderr=True)
+            return True
+        except CommandFailed:
+            return False
+
+    def virtual_size(self, image):
+        """Size of image including all the layers it's based on"""
+        # Newer dockers dropped VirtualSize, and their Size is what it was
+        output = run_cmd(['docker', 'inspect', '--type=image',
+                          '-f', '{{if .VirtualSize}}{{.VirtualSize}}{{else}}{{.Size}}{{end}}', image])
+        if isinstance(output, bytes):
+            output = output.decode('utf-8')
+        return int(output.strip())
+
+    def image_size(self, image, base_image):
+        """Disk space image takes up on top of base_image
+
+        The base image's layers are shared by all the images derived from
+        it, so they don't count towards the budget."""
+        try:
+            base_size = self.virtual_size(base_image)
+        except (CommandFailed, ValueError):
+            base_size = 0
+        return max(self.virtual_size(image) - base_size, 0)
+
+    def ensure(self, base_image, packages, keys='', repos='', logger=LOG):
+        """Build the image for these dependencies unless we have it already
+
+        packages are build dependencies as they appear in Build-Depends.
+        Only their package names go into the image and its tag.
+
+        Returns the (repository, tag) of the image."""
+        from .models import BuilderImage
+        packages = package_names(packages)
+        tag = self.tag(base_image, packages, keys, repos)
+        image = '%s:%s' % (self.repository, tag)
+
+        if not os.path.isdir(self.workdir):
+            os.makedirs(self.workdir)
+
+        with file_lock(os.path.join(self.workdir, '%s.lock' % (tag,))):
+            if BuilderImage.objects.filter(tag=tag).exists() and self.exists(image):
+                BuilderImage.objects.filter(tag=tag).update(last_used=timezone.now())
+                logger.info('Using builder image %s' % (image,))
+                return self.repository, tag
+
+            logger.info('Building builder image %s' % (image,))
+            self.build(image, base_image, packages, keys, repos, logger)
+            BuilderImage.objects.filter(tag=tag).delete()
+            BuilderImage.objects.create(tag=tag, base_image=base_image,
+                                        packages=' '.join(packages),
+                                        size=self.image_size(image, base_image))
+
+        self.evict(keep=tag)
+        return self.repository, tag
+
+    def build(self, image, base_image, packages, keys, repos, logger):
+        context = os.path.join(self.workdir, image.rsplit(':', 1)[1])
+        if os.path.isdir(context):
+            shutil.rmtree(context)
+        os.makedirs(context)
+
+        try:
+            for name, contents in (('keys', keys), ('repos', repos)):
+                if contents:
+                    with open(os.path.join(context, name), 'w') as fp:
+                        fp.write(contents)
+
+            dockerfile = render_to_string('buildsvc/builder-image.Dockerfile',
+                                          {'base_image': base_image,
+                                           'packages': packages,
+                                           'keys': keys,
+                                           'repos': repos,
+                                           'apt_proxy': self.apt_proxy})
+            with open(os.path.join(context, 'Dockerfile'), 'w') as fp:
+                fp.write(dockerfile)
+
+            run_cmd(['docker', 'build', '-t', image, context], logger=logger)
+        finally:
+            shutil.rmtree(context)
+
+    def evict(self, keep=None):
+        """Remove least recently used images until we're within budget
+
+        Returns the number of bytes freed."""
+        from .models import BuilderImage
+        images = list(BuilderImage.objects.order_by('last_used'))
+        total = sum(image.size for image in images)
+
+        freed = 0
+        for image in images:
+            if total - freed <= self.max_bytes:
+                break
+            if image.tag == keep:
+                continue
+
+            with file_lock(os.path.join(self.workdir, '%s.lock' % (image.tag,)), blocking=False) as got_lock:
+                if not got_lock:
+                    continue
+                LOG.info('Evicting builder image %s (%d bytes)' % (image.tag, image.size))
+                try:
+                    run_cmd(['docker', 'rmi', '%s:%s' % (self.repository, image.tag)], discard_stderr=True)
+                except CommandFailed:
+                    # Still used by a running build. Try again next time.
+                    LOG.warning('Failed to remove builder image %s' % (image.tag,), exc_info=True)
+                    continue
+                image.delete()
+                freed += image.size
+
+        return freed
+
+
+def get_builder_images():
+    if getattr(settings, 'BUILDSVC_BUILDER_IMAGE_REPOSITORY', None):
+        return BuilderImages()
+    return None
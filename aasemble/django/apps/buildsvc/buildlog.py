@@ -0,0 +1,214 @@
+import gzip
+import logging
+import os
+import os.path
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+CHUNK_SIZE = 64 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class LogFilePool(object):
+    """Open build log files, no more than max_open of them at a time
+
+    Files are opened for appending, so one that's been closed to make room
+    for another is simply reopened the next time it's written to."""
+
+    def __init__(self, max_open=None):
+        if max_open is None:
+            max_open = getattr(settings, 'BUILDSVC_MAX_OPEN_BUILDLOGS', 32)
+        self.max_open = max_open
+        self.files = OrderedDict()
+        self.lock = threading.RLock()
+
+    def write(self, path, data):
+        with self.lock:
+            fp = self.files.pop(path, None)
+            if fp is None:
+                fp = open(path, 'a')
+            self.files[path] = fp
+            fp.write(data)
+            fp.flush()
+
+            while len(self.files) > self.max_open:
+                old_path, old_fp = self.files.popitem(last=False)
+                old_fp.close()
+
+    def close(self, path):
+        with self.lock:
+            fp = self.files.pop(path, None)
+            if fp is not None:
+                fp.close()
+
+    def __len__(self):
+        return len(self.files)
+
+
+def get_log_file_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LogFilePool()
+        return _pool
+
+
+class BuildLogHandler(logging.Handler):
+    """Writes log records to a build log through the LogFilePool"""
+
+    def __init__(self, path, pool=None):
+        logging.Handler.__init__(self)
+        self.path = path
+        self.pool = pool or get_log_file_pool()
+
+    def emit(self, record):
+        try:
+            self.pool.write(self.path, self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+    def move(self, path):
+        """Rename the log and carry on writing to it under its new name"""
+        self.pool.close(self.path)
+        if os.path.exists(self.path):
+            os.rename(self.path, path)
+        self.path = path
+
+    def close(self):
+        self.pool.close(self.path)
+        logging.Handler.close(self)
+
+
+def build_logger(name, path):
+    """A logger for a single build, writing to the log at path
+
+    Unlike logging.getLogger(), this doesn't register the logger with the
+    logging module, so it goes away along with the build. Records are
+    still passed on to the buildsvc.pkgbuild logger."""
+    logger = logging.Logger(name, logging.DEBUG)
+    logger.parent = logging.getLogger('buildsvc.pkgbuild')
+
+    handler = BuildLogHandler(path)
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(logging.Formatter('%(asctime)s: %(message)s'))
+    logger.addHandler(handler)
+    return logger
+
+
+def open_log(path):
+    """Open the log at path, or its compressed form if it's been compressed"""
+    if not os.path.exists(path) and os.path.exists(path + '.gz'):
+        return gzip.open(path + '.gz', 'rb')
+    return open(path, 'rb')
+
+
+def compress_log(path):
+    """Replace the log at path with a gzip compressed copy
+
+    Returns the path of the compressed log."""
+    gzpath = path + '.gz'
+    tmppath = '%s.tmp.%d' % (gzpath, os.getpid())
+    with open(path, 'rb') as src:
+        with gzip.open(tmppath, 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    os.rename(tmppath, gzpath)
+    os.unlink(path)
+    return gzpath
+
+
+def read_log(path, offset=0, max_bytes=CHUNK_SIZE, whole_lines=True):
+    """Read the log at path, starting at offset
+
+    Returns the data and the offset to continue from. With whole_lines, a
+    partial line at the end of the log is left for the next read, unless
+    it doesn't fit in max_bytes on its own."""
+    try:
+        fp = open_log(path)
+    except (IOError, OSError):
+        return b'', offset
+
+    with fp:
+        fp.seek(offset)
+        data = fp.read(max_bytes)
+
+    if whole_lines and data and not data.endswith(b'\n'):
+        end = data.rfind(b'\n')
+        if end >= 0:
+            data = data[:end + 1]
+        elif len(data) < max_bytes:
+            data = b''
+
+    return data, offset + len(data)
+
+
+class LogTail(object):
+    """Follows the build log of a BuildRecord from a given byte offset"""
+
+    def __init__(self, build_record, offset=0, interval=None):
+        if interval is None:
+            interval = getattr(settings, 'BUILDSVC_LOG_POLL_INTERVAL', 0.5)
+        self.build_record = build_record
+        self.offset = max(offset, 0)
+        self.interval = interval
+
+    @property
+    def complete(self):
+        from .models import BuildRecord
+        return self.build_record.status != BuildRecord.BUILDING
+
+    def refresh(self):
+        # The log is renamed once the version is known, and the status
+        # tells us when no more output is coming.
+        self.build_record.refresh_from_db(fields=['version', 'status'])
+
+    def read(self, max_bytes=CHUNK_SIZE, whole_lines=True):
+        data, self.offset = read_log(self.build_record.buildlog(), self.offset, max_bytes, whole_lines)
+        return data
+
+    def wait(self, timeout):
+        """Read whatever comes after the offset, waiting up to timeout seconds
+
+        Returns as soon as there's something to return, or the build is
+        over."""
+        deadline = time.time() + timeout
+        while True:
+            self.refresh()
+            complete = self.complete
+            data = self.read(whole_lines=not complete)
+            if data or complete or time.time() >= deadline:
+                return data
+            time.sleep(self.interval)
+
+    def follow(self, timeout):
+        """Yield chunks of the log as they're written, for up to timeout seconds
+
+        Stops early once the build is over and all of the log has been
+        read."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            data = self.wait(deadline - time.time())
+            if data:
+                yield data
+            elif self.complete:
+                return
+
+
+def sse_events(tail, timeout):
+    """Server-sent events carrying each line of the log
+
+    The id of each event is the offset following it, so a client that
+    reconnects with Last-Event-ID picks up where it left off."""
+    offset = tail.offset
+    for data in tail.follow(timeout):
+        for line in data.splitlines(True):
+            offset += len(line)
+            yield 'id: %d\ndata: %s\n\n' % (offset, line.rstrip(b'\r\n').decode('utf-8', 'replace'))
+
+    if tail.complete:
+        yield 'event: complete\ndata: %s\n\n' % (tail.build_record.status,)
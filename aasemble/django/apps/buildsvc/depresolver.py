@@ -0,0 +1,200 @@
+import gzip
+import hashlib
+import logging
+import os
+import os.path
+import shutil
+import tempfile
+import time
+
+from debian import deb822
+
+from django.conf import settings
+
+from six.moves.urllib.error import HTTPError, URLError
+from six.moves.urllib.request import urlopen
+
+LOG = logging.getLogger(__name__)
+
+# (url, suites, components). %(release)s is replaced by BUILDSVC_DOCKER_RELEASE
+DEFAULT_BASE_ARCHIVES = (
+    ('http://archive.ubuntu.com/ubuntu',
+     ('%(release)s', '%(release)s-updates', '%(release)s-security'),
+     ('main', 'universe')),
+)
+
+
+class UnsatisfiableBuildDependencies(Exception):
+    def __init__(self, missing):
+        self.missing = missing
+        super(UnsatisfiableBuildDependencies, self).__init__(
+            'Build dependencies not available from any of the configured archives: %s' % (', '.join(missing),))
+
+
+def parse_packages(fp):
+    """Names of the packages in a Packages file, virtual packages included"""
+    names = set()
+    for line in fp:
+        if line.startswith(b'Package:'):
+            names.add(line[len(b'Package:'):].strip().decode('utf-8'))
+        elif line.startswith(b'Provides:'):
+            for provided in line[len(b'Provides:'):].decode('utf-8').split(','):
+                names.add(provided.split('(')[0].strip())
+    return names
+
+
+def package_names(dependencies):
+    """The package to install for each of dependencies (as in Build-Depends)
+
+    That's the first alternative, without version constraints or
+    architecture and profile restrictions, as apt-get would pick it."""
+    # Substitution variables only mean something to dpkg-gencontrol
+    dependencies = [d for d in dependencies if '$' not in d]
+    return sorted(set(relation[0]['name']
+                      for relation in deb822.PkgRelation.parse_relations(', '.join(dependencies))
+                      if relation))
+
+
+def unsatisfied(dependencies, available):
+    """The dependencies (as in Build-Depends) none of whose alternatives are available
+
+    Only package names are compared. Version constraints are left to apt."""
+    # Substitution variables only mean something to dpkg-gencontrol
+    dependencies = [d for d in dependencies if '$' not in d]
+    missing = []
+    for relation in deb822.PkgRelation.parse_relations(', '.join(dependencies)):
+        names = [alternative['name'] for alternative in relation]
+        if not any(name in available for name in names):
+            missing.append(' | '.join(names))
+    return missing
+
+
+class PackageIndexes(object):
+    """Names of the packages available from apt archives
+
+    Archives that are mirrored locally are read from the mirror. Other
+    archives' Packages files are downloaded to cachedir and refreshed once
+    they're older than ttl. The names in each file are kept in memory for
+    as long as the file stays the same."""
+
+    _names = {}
+
+    def __init__(self, cachedir=None, ttl=None):
+        if cachedir is None:
+            cachedir = settings.BUILDSVC_PACKAGE_INDEX_DIR
+        if ttl is None:
+            ttl = getattr(settings, 'BUILDSVC_PACKAGE_INDEX_TTL', 6 * 3600)
+        self.cachedir = cachedir
+        self.ttl = ttl
+
+    def index_dir(self, url, suite, component, arch):
+        """Path of the directory with the Packages files, relative to url"""
+        if not component:
+            # A flat repository, e.g. "deb http://example.com/repo ./"
+            return suite.strip('/')
+        return 'dists/%s/%s/binary-%s' % (suite, component, arch)
+
+    def local_index(self, url, suite, component, arch):
+        from ..mirrorsvc.models import Mirror
+        for mirror in Mirror.objects.filter(url__in=[url.rstrip('/'), url.rstrip('/') + '/']):
+            for name in ('Packages.gz', 'Packages'):
+                path = os.path.join(mirror.archive_dir, self.index_dir(url, suite, component, arch), name)
+                if os.path.isfile(path):
+                    return path
+
+    def cached_index(self, url, suite, component, arch):
+        index_url = '%s/%s/Packages.gz' % (url.rstrip('/'), self.index_dir(url, suite, component, arch))
+        path = os.path.join(self.cachedir, '%s.gz' % (hashlib.sha1(index_url.encode('utf-8')).hexdigest(),))
+
+        if os.path.isfile(path) and time.time() - os.path.getmtime(path) < self.ttl:
+            return path
+
+        try:
+            self.fetch(index_url, path)
+        except (HTTPError, URLError, IOError, OSError) as e:
+            LOG.warning('Failed to fetch %s: %s' % (index_url, e))
+            if not os.path.isfile(path):
+                return None
+        return path
+
+    def fetch(self, url, path):
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+
+        fp = urlopen(url, timeout=getattr(settings, 'BUILDSVC_PACKAGE_INDEX_TIMEOUT', 60))
+        fd, tmppath = tempfile.mkstemp(dir=self.cachedir, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(fp, out)
+            os.rename(tmppath, path)
+        except Exception:
+            os.unlink(tmppath)
+            raise
+        finally:
+            fp.close()
+
+    def names(self, path):
+        mtime = os.path.getmtime(path)
+        cached = self._names.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as fp:
+            names = parse_packages(fp)
+        self._names[path] = (mtime, names)
+        return names
+
+    def available(self, archives, arch):
+        """Names of the packages for arch in the given archives
+
+        Also returns the indexes that couldn't be read."""
+        names = set()
+        unavailable = []
+        for url, suites, components in archives:
+            for suite in suites:
+                for component in components or ['']:
+                    path = self.local_index(url, suite, component, arch) or self.cached_index(url, suite, component, arch)
+                    if path is None:
+                        unavailable.append(' '.join([url, suite, component]).strip())
+                    else:
+                        names |= self.names(path)
+        return names, unavailable
+
+
+class DependencyResolver(object):
+    """Checks that build dependencies can be installed before building
+
+    The base distribution, and the external dependencies of the series,
+    are the archives a build can install packages from."""
+
+    def __init__(self, indexes=None):
+        self.indexes = indexes or PackageIndexes()
+
+    def archives(self, series, release):
+        archives = []
+        for url, suites, components in getattr(settings, 'BUILDSVC_BASE_ARCHIVES', DEFAULT_BASE_ARCHIVES):
+            archives.append((url, [suite % {'release': release} for suite in suites], components))
+        for extdep in series.externaldependency_set.all():
+            archives.append((extdep.url, extdep.series.split(), (extdep.components or '').split()))
+        return archives
+
+    def check(self, dependencies, series, arch, release):
+        """Raises UnsatisfiableBuildDependencies if any of dependencies can't be had
+
+        If some of the indexes couldn't be read, missing dependencies
+        might be in those, so the build is allowed to go ahead."""
+        available, unavailable = self.indexes.available(self.archives(series, release), arch)
+        missing = unsatisfied(dependencies, available)
+        if not missing:
+            return
+        if unavailable:
+            LOG.warning('Could not check build dependencies %s, no index for %s' % (', '.join(missing), ', '.join(unavailable)))
+            return
+        raise UnsatisfiableBuildDependencies(missing)
+
+
+def get_dependency_resolver():
+    if getattr(settings, 'BUILDSVC_PACKAGE_INDEX_DIR', None):
+        return DependencyResolver()
+    return None
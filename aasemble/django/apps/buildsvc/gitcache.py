@@ -0,0 +1,156 @@
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import os.path
+import shutil
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .utils import git_remote_key
+from ...utils import run_cmd
+
+LOG = logging.getLogger(__name__)
+
+
+def directory_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return size
+
+
+@contextmanager
+def file_lock(lockfile, blocking=True):
+    """Hold an exclusive lock on lockfile. Yields whether we got it"""
+    with open(lockfile, 'a') as fp:
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+
+        try:
+            fcntl.flock(fp, flags)
+            got_lock = True
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            got_lock = False
+
+        try:
+            yield got_lock
+        finally:
+            if got_lock:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+class GitCache(object):
+    """Bare repositories shared between builds, one per remote and credentials
+
+    Each checkout fetches incrementally into the cached repository and
+    creates the build tree from it with a local (hardlinking) clone. The
+    least recently used repositories are evicted once the cache grows
+    beyond its disk budget. The size of each repository is recorded
+    whenever it's fetched into, so eviction doesn't walk the whole cache."""
+
+    def __init__(self, basedir=None, max_bytes=None):
+        if basedir is None:
+            basedir = settings.BUILDSVC_GIT_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = getattr(settings, 'BUILDSVC_GIT_CACHE_MAX_BYTES', 10 * 1024 ** 3)
+        self.basedir = basedir
+        self.max_bytes = max_bytes
+
+    def path(self, git_url):
+        digest = hashlib.sha1(git_remote_key(git_url).encode('utf-8')).hexdigest()
+        return os.path.join(self.basedir, '%s.git' % (digest,))
+
+    def locked(self, path, blocking=True):
+        if not os.path.isdir(self.basedir):
+            os.makedirs(self.basedir)
+        return file_lock('%s.lock' % (path,), blocking)
+
+    def _update(self, git_url, path, logger):
+        if not os.path.isdir(path):
+            tmppath = '%s.tmp' % (path,)
+            if os.path.isdir(tmppath):
+                shutil.rmtree(tmppath)
+            run_cmd(['git', 'init', '--bare', tmppath], logger=logger)
+            run_cmd(['git', 'remote', 'add', 'origin', git_url], cwd=tmppath, logger=logger)
+            os.rename(tmppath, path)
+
+        run_cmd(['git', 'fetch', '--prune', 'origin',
+                 '+refs/heads/*:refs/heads/*',
+                 '+refs/tags/*:refs/tags/*'], cwd=path, logger=logger)
+
+        # The mtime of the repository is what LRU eviction goes by
+        os.utime(path, None)
+        self.record_size(path)
+
+    def size_file(self, path):
+        return '%s.size' % (path,)
+
+    def record_size(self, path):
+        """Note down the size of a repository, so eviction needn't walk it"""
+        size = directory_size(path)
+        with open(self.size_file(path), 'w') as fp:
+            fp.write(str(size))
+        return size
+
+    def entry_size(self, path):
+        try:
+            with open(self.size_file(path), 'r') as fp:
+                return int(fp.read())
+        except (IOError, OSError, ValueError):
+            return self.record_size(path)
+
+    def clone(self, git_url, branch, dest, logger=LOG):
+        """Bring the cache up to date and create a working tree in dest"""
+        path = self.path(git_url)
+        with self.locked(path):
+            self._update(git_url, path, logger)
+            run_cmd(['git', 'clone', '--local', '-b', branch, path, dest], logger=logger)
+
+        run_cmd(['git', 'remote', 'set-url', 'origin', git_url], cwd=dest, logger=logger)
+        self.evict(keep=path)
+
+    def entries(self):
+        if not os.path.isdir(self.basedir):
+            return []
+        return [os.path.join(self.basedir, d) for d in os.listdir(self.basedir)
+                if d.endswith('.git') and os.path.isdir(os.path.join(self.basedir, d))]
+
+    def evict(self, keep=None):
+        """Remove least recently used repositories until we're within budget
+
+        Repositories that are in use are skipped. Returns the number of
+        bytes freed."""
+        entries = [(os.path.getmtime(path), path, self.entry_size(path)) for path in self.entries()]
+        total = sum(size for mtime, path, size in entries)
+
+        freed = 0
+        for mtime, path, size in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            with self.locked(path, blocking=False) as got_lock:
+                if not got_lock:
+                    continue
+                LOG.info('Evicting %s from git cache (%d bytes)' % (path, size))
+                shutil.rmtree(path)
+                os.unlink(self.size_file(path))
+                freed += size
+
+        return freed
+
+
+def get_git_cache():
+    if getattr(settings, 'BUILDSVC_GIT_CACHE_DIR', None):
+        return GitCache()
+    return None
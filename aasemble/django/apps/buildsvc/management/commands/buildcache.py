@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...buildcache import get_build_cache
+
+
+class Command(BaseCommand):
+    help = 'Shows the size and hit rate of the build cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help='Evict entries until the cache is within budget')
+
+    def handle(self, *args, **options):
+        build_cache = get_build_cache()
+        if build_cache is None:
+            raise CommandError('The build cache is not enabled. Set BUILDSVC_BUILD_CACHE_DIR.')
+
+        if options['evict']:
+            self.stdout.write('Freed %d bytes' % (build_cache.evict(),))
+
+        stats = build_cache.stats()
+        self.stdout.write('Entries:   %d' % (stats['entries'],))
+        self.stdout.write('Size:      %d of %d bytes' % (stats['size'], stats['max_size']))
+        self.stdout.write('Hits:      %d' % (stats['hits'],))
+        self.stdout.write('Misses:    %d' % (stats['misses'],))
+        self.stdout.write('Hit rate:  %.1f%%' % (stats['hit_rate'] * 100,))
+        self.stdout.write('Stores:    %d' % (stats['stores'],))
+        self.stdout.write('Evictions: %d' % (stats['evictions'],))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Repository
+from ...retention import expired_builds, prune_builds
+
+
+class Command(BaseCommand):
+    help = 'Deletes the logs and archives the records of builds past their retention'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only show how many builds would be pruned')
+
+    def handle(self, *args, **options):
+        total_pruned = total_freed = 0
+        for repository in Repository.objects.all():
+            if options['dry_run']:
+                pruned, freed = len(expired_builds(repository)), 0
+            else:
+                pruned, freed = prune_builds(repository)
+            if pruned:
+                self.stdout.write('%s: %d builds, %d bytes' % (repository, pruned, freed))
+            total_pruned += pruned
+            total_freed += freed
+        self.stdout.write('Total: %d builds, %d bytes' % (total_pruned, total_freed))
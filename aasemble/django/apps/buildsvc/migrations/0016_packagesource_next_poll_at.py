@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buildsvc', '0015_packagesource_webhook_registered'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packagesource',
+            name='next_poll_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='packagesource',
+            name='poll_interval',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from aasemble.django.apps.buildsvc.utils import normalize_git_url
+
+
+def populate_canonical_git_url(apps, schema_editor):
+    PackageSource = apps.get_model('buildsvc', 'PackageSource')
+    for ps in PackageSource.objects.all():
+        ps.canonical_git_url = normalize_git_url(ps.git_url)
+        ps.save(update_fields=['canonical_git_url'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buildsvc', '0017_tasklease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packagesource',
+            name='canonical_git_url',
+            field=models.CharField(default='', max_length=255, editable=False, db_index=True),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_canonical_git_url, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buildsvc', '0018_packagesource_canonical_git_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packagesource',
+            name='build_debounce',
+            field=models.IntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='packagesource',
+            name='pending_triggers',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='buildrecord',
+            name='coalesced_triggers',
+            field=models.IntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buildsvc', '0019_build_debounce'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='buildrecord',
+            name='status',
+            field=models.CharField(default='', max_length=20, blank=True, choices=[('building', 'Building'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('skipped', 'Skipped'), ('superseded', 'Superseded')]),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buildsvc', '0020_buildrecord_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BuildRequest',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('sha', models.CharField(max_length=100, null=True, blank=True)),
+                ('priority', models.IntegerField(default=10, choices=[(10, 'Poll'), (20, 'Webhook'), (30, 'Manual')])),
+                ('state', models.CharField(default='queued', max_length=20, db_index=True, choices=[('queued', 'Queued'), ('dispatched', 'Dispatched')])),
+                ('created', models.DateTimeField(default=timezone.now)),
+                ('not_before', models.DateTimeField(default=timezone.now)),
+                ('dispatched', models.DateTimeField(null=True, blank=True)),
+                ('source', models.ForeignKey(to='buildsvc.PackageSource')),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrorsvc', '0012_remove_uuid_null'),
+        ('buildsvc', '0021_buildrequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='series',
+            name='architectures',
+            field=models.ManyToManyField(to='mirrorsvc.Architecture', blank=True),
+        ),
+    ]
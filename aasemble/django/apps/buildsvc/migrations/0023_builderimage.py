@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buildsvc', '0022_series_architectures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BuilderImage',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('tag', models.CharField(unique=True, max_length=255)),
+                ('base_image', models.CharField(max_length=255)),
+                ('packages', models.TextField(blank=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('created', models.DateTimeField(default=timezone.now)),
+                ('last_used', models.DateTimeField(default=timezone.now, db_index=True)),
+            ],
+        ),
+    ]
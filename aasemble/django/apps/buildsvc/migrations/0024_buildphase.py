@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buildsvc', '0023_builderimage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BuildPhase',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(max_length=20, choices=[('checkout', 'Checkout'), ('dependencies', 'Dependency detection'), ('source_build', 'Source build'), ('binary_build', 'Binary build'), ('cache_restore', 'Build cache restore'), ('include', 'Include'), ('export', 'Export')])),
+                ('started', models.DateTimeField()),
+                ('duration', models.FloatField(default=0)),
+                ('succeeded', models.BooleanField(default=False)),
+                ('artifact_bytes', models.BigIntegerField(null=True, blank=True)),
+                ('build', models.ForeignKey(related_name='phases', to='buildsvc.BuildRecord')),
+            ],
+            options={
+                'ordering': ('started', 'id'),
+            },
+        ),
+    ]
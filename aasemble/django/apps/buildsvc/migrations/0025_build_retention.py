@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buildsvc', '0024_buildphase'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='build_retention_count',
+            field=models.IntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='repository',
+            name='build_retention_days',
+            field=models.IntegerField(null=True, blank=True),
+        ),
+    ]
@@ -3,7 +3,10 @@ import os
 import os.path
 import shutil
 import tempfile
+import time
 import uuid
+from contextlib import contextmanager
+from datetime import timedelta
 
 from allauth.socialaccount.models import SocialToken
 
@@ -11,10 +14,11 @@ import deb822
 
 from django.conf import settings
 from django.contrib.auth import models as auth_models
-from django.core.cache import cache
-from django.db import models
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, models, transaction
 from django.forms import ModelForm
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.module_loading import import_string
 
@@ -23,6 +27,12 @@ import github3
 from six.moves.urllib.parse import urlparse
 
 from . import tasks
+from .buildlog import build_logger, compress_log
+from .gitcache import get_git_cache
+from .poller import poll_sources
+from .utils import normalize_git_url
+from ..mirrorsvc.proxy import proxied_url
+from ...exceptions import CommandFailed
 from ...utils import recursive_render, run_cmd
 
 LOG = logging.getLogger(__name__)
@@ -83,6 +93,8 @@ class Repository(models.Model):
     name = models.CharField(max_length=100)
     key_id = models.CharField(max_length=100)
     extra_admins = models.ManyToManyField(auth_models.Group)
+    build_retention_count = models.IntegerField(null=True, blank=True)
+    build_retention_days = models.IntegerField(null=True, blank=True)
 
     class Meta:
         verbose_name_plural = 'repositories'
@@ -103,6 +115,20 @@ class Repository(models.Model):
             return cls.objects.all()
         return cls.objects.filter(user=user) | cls.objects.filter(extra_admins__in=user.groups.all())
 
+    @property
+    def retention_count(self):
+        """Number of most recent builds of each source to keep"""
+        if self.build_retention_count is not None:
+            return self.build_retention_count
+        return getattr(settings, 'BUILDSVC_BUILD_RETENTION_COUNT', 50)
+
+    @property
+    def retention_days(self):
+        """Builds younger than this are kept regardless of retention_count"""
+        if self.build_retention_days is not None:
+            return self.build_retention_days
+        return getattr(settings, 'BUILDSVC_BUILD_RETENTION_DAYS', 30)
+
     def ensure_key(self):
         if not self.key_id:
             self.key_id = get_repo_driver(self).generate_key()
@@ -153,11 +179,11 @@ class Repository(models.Model):
         self.export_key()
         self._reprepro('export')
 
-    def process_changes(self, series_name, changes_file):
+    def include_changes(self, series_name, *changes_files):
         self.ensure_directory_structure()
-        remove_ddebs_from_changes(changes_file)
-        self._reprepro('--ignore=wrongdistribution', 'include', series_name, changes_file)
-        self.export()
+        for changes_file in changes_files:
+            remove_ddebs_from_changes(changes_file)
+            self._reprepro('--ignore=wrongdistribution', 'include', series_name, changes_file)
 
     @property
     def base_url(self):
@@ -180,10 +206,20 @@ class Series(models.Model):
     uuid = models.UUIDField(unique=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=100)
     repository = models.ForeignKey(Repository, related_name='series')
+    architectures = models.ManyToManyField('mirrorsvc.Architecture', blank=True)
 
     def __str__(self):
         return '%s/%s' % (self.repository.name, self.name)
 
+    def binary_architectures(self):
+        """Names of the architectures to build binary packages for"""
+        names = [arch.apt_mirror_prefix for arch in self.architectures.all()
+                 if arch.apt_mirror_prefix not in ('src', 'source')]
+        return sorted(names) or list(getattr(settings, 'BUILDSVC_DEFAULT_ARCHITECTURES', ['amd64']))
+
+    def reprepro_architectures(self):
+        return ' '.join(self.binary_architectures() + ['source'])
+
     def binary_source_list(self, force_trusted=False):
         return self._source_list(prefix='deb', force_trusted=force_trusted)
 
@@ -203,8 +239,8 @@ class Series(models.Model):
     class Meta:
         verbose_name_plural = 'series'
 
-    def process_changes(self, changes_file):
-        self.repository.process_changes(self.name, changes_file)
+    def include_changes(self, *changes_files):
+        self.repository.include_changes(self.name, *changes_files)
 
     def export(self):
         self.repository.export()
@@ -225,6 +261,11 @@ class ExternalDependency(models.Model):
     def deb_line(self):
         return 'deb %s %s %s' % (self.url, self.series, self.components)
 
+    @property
+    def proxied_deb_line(self):
+        """deb_line, going through the package proxy if one is configured"""
+        return 'deb %s %s %s' % (proxied_url(self.url), self.series, self.components)
+
     def user_can_modify(self, user):
         return self.own_series.user_can_modify(user)
 
@@ -233,10 +274,15 @@ class NotAValidGithubRepository(Exception):
     pass
 
 
+class BuildSuperseded(Exception):
+    pass
+
+
 @python_2_unicode_compatible
 class PackageSource(models.Model):
     uuid = models.UUIDField(unique=True, default=uuid.uuid4, editable=False)
     git_url = models.URLField()
+    canonical_git_url = models.CharField(max_length=255, db_index=True, editable=False)
     branch = models.CharField(max_length=100)
     series = models.ForeignKey(Series, related_name='sources')
     last_seen_revision = models.CharField(max_length=64, null=True, blank=True)
@@ -244,42 +290,111 @@ class PackageSource(models.Model):
     last_built_name = models.CharField(max_length=64, null=True, blank=True)
     build_counter = models.IntegerField(default=0)
     webhook_registered = models.BooleanField(default=False)
+    next_poll_at = models.DateTimeField(default=timezone.now, db_index=True)
+    poll_interval = models.IntegerField(default=0)
+    build_debounce = models.IntegerField(null=True, blank=True)
+    pending_triggers = models.IntegerField(default=0)
 
     def __str__(self):
         return '%s/%s' % (self.git_url, self.branch)
 
+    def save(self, *args, **kwargs):
+        self.canonical_git_url = normalize_git_url(self.git_url)
+        return super(PackageSource, self).save(*args, **kwargs)
+
+    @classmethod
+    def lookup_by_git_url(cls, git_url):
+        return cls.objects.filter(canonical_git_url=normalize_git_url(git_url))
+
+    @classmethod
+    def due_for_polling(cls, now=None):
+        return cls.objects.filter(webhook_registered=False,
+                                  next_poll_at__lte=now or timezone.now())
+
     def poll(self):
-        cmd = ['git', 'ls-remote', self.git_url,
-               'refs/heads/%s' % self.branch]
-        stdout = run_cmd(cmd)
-        sha = stdout.split('\t')[0]
+        return bool(poll_sources([self]))
 
+    def record_revision(self, sha):
+        """Record a new branch head we learned about without polling"""
         if sha == self.last_seen_revision:
             return False
 
         self.last_seen_revision = sha
-        self.save()
+        self.schedule_next_poll(changed=True)
+        self.save(update_fields=['last_seen_revision', 'poll_interval', 'next_poll_at'])
         return True
 
+    def schedule_next_poll(self, changed, now=None):
+        """Back off exponentially while nothing happens, start over on changes"""
+        min_interval = getattr(settings, 'BUILDSVC_POLL_MIN_INTERVAL', 10)
+        max_interval = getattr(settings, 'BUILDSVC_POLL_MAX_INTERVAL', 3600)
+
+        if changed or not self.poll_interval:
+            self.poll_interval = min_interval
+        else:
+            self.poll_interval = min(self.poll_interval * 2, max_interval)
+
+        self.next_poll_at = (now or timezone.now()) + timedelta(seconds=self.poll_interval)
+
     def checkout(self, sha=None, logger=LOG):
         tmpdir = tempfile.mkdtemp()
         builddir = os.path.join(tmpdir, 'build')
         try:
-            run_cmd(['git',
-                     'clone', self.git_url,
-                     '-b', self.branch,
-                     'build'],
-                    cwd=tmpdir, logger=logger)
+            git_cache = get_git_cache()
+            if git_cache:
+                git_cache.clone(self.git_url, self.branch, builddir, logger=logger)
+            elif sha and getattr(settings, 'BUILDSVC_SHALLOW_CHECKOUT', True):
+                self.shallow_checkout(builddir, sha, logger=logger)
+                sha = None
+            else:
+                run_cmd(['git',
+                         'clone', self.git_url,
+                         '-b', self.branch,
+                         'build'],
+                        cwd=tmpdir, logger=logger)
 
             if sha:
                 run_cmd(['git', 'reset', '--hard', sha], cwd=builddir, logger=logger)
 
             stdout = run_cmd(['git', 'rev-parse', 'HEAD'], cwd=builddir, logger=logger)
-            return tmpdir, builddir, stdout.strip()
+            return tmpdir, builddir, stdout.decode('utf-8').strip()
         except:
             shutil.rmtree(tmpdir)
             raise
 
+    def shallow_checkout(self, builddir, sha, logger=LOG):
+        """Fetch just the given commit, without any history"""
+        run_cmd(['git', 'init', builddir], logger=logger)
+        run_cmd(['git', 'remote', 'add', 'origin', self.git_url], cwd=builddir, logger=logger)
+
+        clone_filter = getattr(settings, 'BUILDSVC_CHECKOUT_FILTER', None)
+        if clone_filter:
+            run_cmd(['git', 'config', 'remote.origin.promisor', 'true'], cwd=builddir, logger=logger)
+            run_cmd(['git', 'config', 'remote.origin.partialclonefilter', clone_filter], cwd=builddir, logger=logger)
+
+        try:
+            run_cmd(['git', 'fetch', '--depth', '1', 'origin', sha], cwd=builddir, logger=logger)
+        except CommandFailed:
+            # Not every server lets you fetch a commit no ref points to.
+            # Try the branch instead, and if it has moved on, deepen it.
+            ref = 'refs/heads/%s' % (self.branch,)
+            run_cmd(['git', 'fetch', '--depth', '1', 'origin', ref], cwd=builddir, logger=logger)
+            fetched = run_cmd(['git', 'rev-parse', 'FETCH_HEAD'], cwd=builddir, logger=logger)
+            if fetched.decode('utf-8').strip() != sha:
+                run_cmd(['git', 'fetch', '--unshallow', 'origin', ref], cwd=builddir, logger=logger)
+            run_cmd(['git', 'checkout', '-q', '-B', self.branch, sha], cwd=builddir, logger=logger)
+        else:
+            run_cmd(['git', 'checkout', '-q', '-B', self.branch, 'FETCH_HEAD'], cwd=builddir, logger=logger)
+
+    def ensure_history(self, builddir, logger=LOG):
+        """Turn a shallow checkout into one with the full branch history and tags"""
+        if os.path.exists(os.path.join(builddir, '.git', 'shallow')):
+            # Tags aren't followed for a refspec without a destination, and
+            # anything deriving the version from git needs them
+            run_cmd(['git', 'fetch', '--unshallow', '--tags', 'origin',
+                     '+refs/heads/%s:refs/remotes/origin/%s' % (self.branch, self.branch)],
+                    cwd=builddir, logger=logger)
+
     @property
     def long_name(self):
         return '_'.join(filter(bool, urlparse(self.git_url).path.split('/')))
@@ -288,48 +403,117 @@ class PackageSource(models.Model):
     def name(self):
         return self.git_url.split('/')[-1].replace('_', '-')
 
-    def build(self):
-        tasks.build.delay(self.id)
+    def schedule_poll(self):
+        return tasks.schedule_poll(self.id)
 
-    def build_real(self):
+    @property
+    def debounce_window(self):
+        """Seconds to hold back a build so that further pushes can join it"""
+        if self.build_debounce is not None:
+            return self.build_debounce
+        return getattr(settings, 'BUILDSVC_BUILD_DEBOUNCE', 0)
+
+    def build(self, sha=None, priority=None):
+        if priority is None:
+            priority = BuildRequest.POLL
+        # Someone asking for a build by hand doesn't want to wait for more pushes
+        countdown = 0 if priority >= BuildRequest.MANUAL else self.debounce_window
+        PackageSource.objects.filter(id=self.id).update(pending_triggers=models.F('pending_triggers') + 1)
+        return tasks.schedule_build(self.id, sha or self.last_seen_revision,
+                                    countdown=countdown, priority=priority)
+
+    def take_pending_triggers(self):
+        """Claim the triggers that have piled up for the build that's starting"""
+        self.refresh_from_db(fields=['pending_triggers'])
+        triggers = self.pending_triggers
+        PackageSource.objects.filter(id=self.id).update(pending_triggers=models.F('pending_triggers') - triggers)
+        self.pending_triggers -= triggers
+        return triggers
+
+    def build_real(self, sha=None, triggers=1):
+        # Only build_counter, or we'd write back stale pending_triggers and
+        # poll schedules that others have updated in the meantime
         self.build_counter += 1
-        self.save()
+        self.save(update_fields=['build_counter'])
 
-        br = BuildRecord(source=self, build_counter=self.build_counter)
+        br = BuildRecord(source=self, build_counter=self.build_counter, coalesced_triggers=triggers,
+                         status=BuildRecord.BUILDING)
         br.save()
 
-        tmpdir, self.builddir, br.sha = self.checkout(logger=br.logger)
-        br.save()
+        tmpdir = None
         try:
-            import pkgbuild
-            builder_cls = pkgbuild.choose_builder(self.builddir)
+            with br.phase(BuildPhase.CHECKOUT):
+                tmpdir, self.builddir, br.sha = self.checkout(sha=sha or self.last_seen_revision, logger=br.logger)
+            br.save()
+
+            br.check_superseded()
+
+            from . import pkgbuild
+            builder_cls = pkgbuild.choose_builder(self.builddir, br.sha)
+            if builder_cls.history_needed(self.builddir):
+                self.ensure_history(self.builddir, logger=br.logger)
             builder = builder_cls(tmpdir, self, br)
 
             builder.build()
 
-            changes_files = filter(lambda s: s.endswith('.changes'), os.listdir(tmpdir))
+            # Don't publish something that is already out of date
+            br.check_superseded()
+
+            changes_files = [os.path.join(tmpdir, f) for f in sorted(os.listdir(tmpdir)) if f.endswith('.changes')]
+
+            if changes_files:
+                with br.phase(BuildPhase.INCLUDE):
+                    self.series.include_changes(*changes_files)
+            with br.phase(BuildPhase.EXPORT):
+                self.series.export()
+            br.set_status(BuildRecord.SUCCEEDED)
+        except BuildSuperseded:
+            br.logger.info('Build aborted: %s has moved on to %s' % (self.branch, self.last_seen_revision))
+            br.set_status(BuildRecord.SUPERSEDED)
+        except Exception:
+            br.set_status(BuildRecord.FAILED)
+            raise
+        finally:
+            # checkout() cleans up after itself if it fails
+            if tmpdir:
+                shutil.rmtree(tmpdir)
+            br.finish_buildlog()
+
+    def revision_already_built(self, sha):
+        """Whether sha has been built, or is being built by another worker"""
+        ttl = getattr(settings, 'BUILDSVC_TASK_LEASE_TTL', 3600)
+        recent = timezone.now() - timedelta(seconds=ttl)
+        builds = self.buildrecord_set.filter(sha=sha)
+        if builds.filter(status=BuildRecord.SUCCEEDED).exists():
+            return True
+        return builds.filter(status=BuildRecord.BUILDING, build_started__gte=recent).exists()
 
-            for changes_file in changes_files:
-                self.series.process_changes(os.path.join(tmpdir, changes_file))
+    def skip_build(self, sha, triggers=1):
+        return BuildRecord.objects.create(source=self, build_counter=self.build_counter, sha=sha,
+                                          coalesced_triggers=triggers, status=BuildRecord.SKIPPED)
 
-            self.series.export()
-        finally:
-            shutil.rmtree(tmpdir)
+    def newer_revision_pending(self, sha):
+        """Whether a queued build will take care of something newer than sha"""
+        self.refresh_from_db(fields=['last_seen_revision'])
+        if not self.last_seen_revision or self.last_seen_revision == sha:
+            return False
+        return TaskLease.is_held(tasks.build_lease_key(self.id))
 
     def delete_on_filesystem(self):
         if self.last_built_name:
-            tasks.reprepro.delay(self.series.repository.id, 'removesrc', self.series.name, self.last_built_name)
+            tasks.schedule_reprepro(self.series.repository.id, 'removesrc', self.series.name, self.last_built_name)
 
     def user_can_modify(self, user):
         return self.series.user_can_modify(user)
 
     def github_owner_repo(self):
-        github_prefix = 'https://github.com/'
+        github_prefix = 'github.com/'
 
-        if not self.git_url.startswith(github_prefix):
+        canonical_git_url = normalize_git_url(self.git_url)
+        if not canonical_git_url.startswith(github_prefix):
             raise NotAValidGithubRepository()
 
-        owner_repo = self.git_url[len(github_prefix):]
+        owner_repo = canonical_git_url[len(github_prefix):]
 
         parts = owner_repo.split('/')
 
@@ -374,6 +558,19 @@ class BuildRecord(models.Model):
     build_counter = models.IntegerField(default=0)
     build_started = models.DateTimeField(auto_now_add=True)
     sha = models.CharField(max_length=100, null=True, blank=True)
+    coalesced_triggers = models.IntegerField(default=1)
+
+    BUILDING = 'building'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+    SUPERSEDED = 'superseded'
+    STATUS_CHOICES = ((BUILDING, 'Building'),
+                      (SUCCEEDED, 'Succeeded'),
+                      (FAILED, 'Failed'),
+                      (SKIPPED, 'Skipped'),
+                      (SUPERSEDED, 'Superseded'))
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, blank=True, default='')
 
     def __init__(self, *args, **kwargs):
         self._logger = None
@@ -384,29 +581,15 @@ class BuildRecord(models.Model):
     def logger(self):
         logpath = self.buildlog()
 
-        if not logpath == self._saved_logpath:
-            LOG.debug('logpath changed from %r to %r' % (self._saved_logpath, logpath))
-
+        if self._logger is None:
+            self._logger = build_logger('buildsvc.pkgbuild.%s_%s' % (self.source.name, self.build_counter), logpath)
+        elif logpath != self._saved_logpath:
             # buildlog path changed, move it
-            if self._saved_logpath and os.path.exists(self._saved_logpath):
-                LOG.debug('Existing logfile found. Renaming')
-                os.rename(self._saved_logpath, self.buildlog())
-
-            logger = logging.getLogger('buildsvc.pkgbuild.%s_%s' % (self.source.name, self.build_counter))
-            logger.setLevel(logging.DEBUG)
-
-            for handler in logger.handlers:
-                logger.removeHandler(handler)
-
-            formatter = logging.Formatter('%(asctime)s: %(message)s')
-            logfp = logging.FileHandler(logpath)
-            logfp.setLevel(logging.DEBUG)
-            logfp.setFormatter(formatter)
-
-            logger.addHandler(logfp)
-            self._logger = logger
-            self._saved_logpath = logpath
+            LOG.debug('logpath changed from %r to %r' % (self._saved_logpath, logpath))
+            for handler in self._logger.handlers:
+                handler.move(logpath)
 
+        self._saved_logpath = logpath
         return self._logger
 
     def logpath(self):
@@ -427,20 +610,210 @@ class BuildRecord(models.Model):
 
         return path
 
+    def stored_buildlog(self):
+        """Path of the build log as stored, and whether it's compressed"""
+        path = self.buildlog()
+        if os.path.exists(path + '.gz'):
+            return path + '.gz', True
+        return path, False
+
+    def finish_buildlog(self):
+        """Close the build log and compress it. Nothing more gets logged"""
+        if self._logger:
+            for handler in self._logger.handlers[:]:
+                self._logger.removeHandler(handler)
+                handler.close()
+            self._logger = self._saved_logpath = None
+
+        path = self.buildlog()
+        if os.path.exists(path):
+            compress_log(path)
+
+    def buildlog_url(self):
+        return reverse('buildsvc:buildlog', kwargs={'build_uuid': self.uuid})
+
+    def set_status(self, status):
+        self.status = status
+        self.save(update_fields=['status'])
+
+    def check_superseded(self):
+        """Abort the build if a newer revision has been queued for building"""
+        if self.sha and self.source.newer_revision_pending(self.sha):
+            raise BuildSuperseded()
+
+    @contextmanager
+    def phase(self, name):
+        """Record how long the enclosed block takes and whether it succeeds
+
+        The block may set artifact_bytes on the yielded BuildPhase."""
+        phase = BuildPhase(build=self, name=name, started=timezone.now(), succeeded=False)
+        start = time.time()
+        try:
+            yield phase
+            phase.succeeded = True
+        finally:
+            phase.duration = time.time() - start
+            phase.save()
+
+
+class BuildPhase(models.Model):
+    CHECKOUT = 'checkout'
+    DEPENDENCIES = 'dependencies'
+    SOURCE_BUILD = 'source_build'
+    BINARY_BUILD = 'binary_build'
+    CACHE_RESTORE = 'cache_restore'
+    INCLUDE = 'include'
+    EXPORT = 'export'
+    NAME_CHOICES = ((CHECKOUT, 'Checkout'),
+                    (DEPENDENCIES, 'Dependency detection'),
+                    (SOURCE_BUILD, 'Source build'),
+                    (BINARY_BUILD, 'Binary build'),
+                    (CACHE_RESTORE, 'Build cache restore'),
+                    (INCLUDE, 'Include'),
+                    (EXPORT, 'Export'))
+
+    build = models.ForeignKey(BuildRecord, related_name='phases')
+    name = models.CharField(max_length=20, choices=NAME_CHOICES)
+    started = models.DateTimeField()
+    duration = models.FloatField(default=0)
+    succeeded = models.BooleanField(default=False)
+    artifact_bytes = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('started', 'id')
+
+
+@python_2_unicode_compatible
+class TaskLease(models.Model):
+    """Marks a piece of work as in flight so it is not queued twice
+
+    Leases expire, so work whose worker crashed before releasing its
+    lease can be picked up again."""
+    key = models.CharField(max_length=255, unique=True)
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.key
+
+    @classmethod
+    def acquire(cls, key, ttl=None):
+        if ttl is None:
+            ttl = getattr(settings, 'BUILDSVC_TASK_LEASE_TTL', 3600)
+
+        now = timezone.now()
+        expires = now + timedelta(seconds=ttl)
+
+        # Reclaim a stale lease
+        if cls.objects.filter(key=key, expires__lte=now).update(expires=expires) > 0:
+            LOG.info('Reclaimed stale lease %s' % (key,))
+            return True
+
+        try:
+            with transaction.atomic():
+                cls.objects.create(key=key, expires=expires)
+            return True
+        except IntegrityError:
+            return False
+
+    @classmethod
+    def release(cls, key):
+        cls.objects.filter(key=key).delete()
+
+    @classmethod
+    def is_held(cls, key):
+        return cls.objects.filter(key=key, expires__gt=timezone.now()).exists()
+
+    @classmethod
+    def reap(cls, now=None):
+        cls.objects.filter(expires__lte=now or timezone.now()).delete()
+
+
+@python_2_unicode_compatible
+class BuildRequest(models.Model):
+    """A build waiting for a build slot, or occupying one
+
+    At most one request per source is queued at any time. Once dispatched
+    to a worker the request holds its slot until the build finishes."""
+    POLL = 10
+    WEBHOOK = 20
+    MANUAL = 30
+    PRIORITY_CHOICES = ((POLL, 'Poll'),
+                        (WEBHOOK, 'Webhook'),
+                        (MANUAL, 'Manual'))
+
+    QUEUED = 'queued'
+    DISPATCHED = 'dispatched'
+    STATE_CHOICES = ((QUEUED, 'Queued'),
+                     (DISPATCHED, 'Dispatched'))
+
+    source = models.ForeignKey(PackageSource)
+    sha = models.CharField(max_length=100, null=True, blank=True)
+    priority = models.IntegerField(choices=PRIORITY_CHOICES, default=POLL)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default=QUEUED, db_index=True)
+    created = models.DateTimeField(default=timezone.now)
+    not_before = models.DateTimeField(default=timezone.now)
+    dispatched = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '%s (%s)' % (self.source, self.get_state_display())
+
+    @classmethod
+    def enqueue(cls, package_source_id, sha=None, priority=POLL, not_before=None):
+        """Queue a build, or fold it into the one already queued for the source"""
+        if not_before is None:
+            not_before = timezone.now()
+
+        req = cls.promote(package_source_id, sha, priority, not_before)
+        if req is None:
+            req = cls.objects.create(source_id=package_source_id, sha=sha,
+                                     priority=priority, not_before=not_before)
+        return req
+
+    @classmethod
+    def promote(cls, package_source_id, sha=None, priority=POLL, not_before=None):
+        """Update the queued request for the source, if any, to the newer trigger
+
+        The request keeps the higher priority and the earlier start time."""
+        queued = cls.objects.filter(source_id=package_source_id, state=cls.QUEUED)
+        queued.filter(priority__lt=priority).update(priority=priority)
+        if not_before is not None:
+            queued.filter(not_before__gt=not_before).update(not_before=not_before)
+        if sha:
+            queued.update(sha=sha)
+        return queued.first()
+
+    def claim(self, now=None):
+        """Move the request from the queue onto a build slot
+
+        Returns False if another dispatcher got there first."""
+        now = now or timezone.now()
+        if not BuildRequest.objects.filter(id=self.id, state=self.QUEUED).update(state=self.DISPATCHED, dispatched=now):
+            return False
+        self.state = self.DISPATCHED
+        self.dispatched = now
+        return True
+
     @property
-    def base_url(self):
-        cache_key = 'source_%s_base_url' % (self.source_id,)
+    def repository_id(self):
+        return self.source.series.repository_id
 
-        val = cache.get(cache_key)
+    @property
+    def user_id(self):
+        return self.source.series.repository.user_id
 
-        if val is None:
-            val = self.source.series.repository.base_url
-            cache.set(cache_key, val, 5)
 
-        return val
+@python_2_unicode_compatible
+class BuilderImage(models.Model):
+    """A docker image with a set of build dependencies pre-installed"""
+    tag = models.CharField(max_length=255, unique=True)
+    base_image = models.CharField(max_length=255)
+    packages = models.TextField(blank=True)
+    size = models.BigIntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
 
-    def buildlog_url(self):
-        return '%s/buildlogs/%s' % (self.base_url, self.logpath())
+    def __str__(self):
+        return self.tag
 
 
 @python_2_unicode_compatible
@@ -474,4 +847,4 @@ class GithubRepository(models.Model):
 class PackageSourceForm(ModelForm):
     class Meta:
         model = PackageSource
-        fields = ['git_url', 'branch', 'series']
+        fields = ['git_url', 'branch', 'series', 'build_debounce']
@@ -0,0 +1,52 @@
+import sys
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+_install_lock = threading.Lock()
+
+
+class OutputRouter(object):
+    """Stands in for sys.stdout, passing output on to whichever stream the
+    current thread has asked for, or to the real stdout otherwise
+
+    It's installed once and then left alone, so builds running in
+    different threads (or green threads) of one process don't trample on
+    each other's output the way swapping sys.stdout back and forth does."""
+
+    def __init__(self, default):
+        self.default = default
+
+    @property
+    def target(self):
+        return getattr(_local, 'stream', None) or self.default
+
+    def write(self, data):
+        return self.target.write(data)
+
+    def writelines(self, lines):
+        return self.target.writelines(lines)
+
+    def flush(self):
+        return self.target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+def install():
+    with _install_lock:
+        if not isinstance(sys.stdout, OutputRouter):
+            sys.stdout = OutputRouter(sys.stdout)
+
+
+@contextmanager
+def capture_output(stream):
+    """Send whatever the current thread writes to sys.stdout to stream"""
+    install()
+    previous = getattr(_local, 'stream', None)
+    _local.stream = stream
+    try:
+        yield stream
+    finally:
+        _local.stream = previous
@@ -1,26 +1,59 @@
 from __future__ import absolute_import
 
 import os
-import sys
+import shutil
+from multiprocessing.pool import ThreadPool
 
 import dbuild
 
+from debian import deb822
 from debian.debian_support import version_compare
 
 from django.conf import settings
 from django.template.loader import render_to_string
 from django.utils import timezone
 
+from .manifest import SourceManifest
+from ..buildcache import build_cache_key, get_build_cache
+from ..builderimages import get_builder_images
+from ..depresolver import UnsatisfiableBuildDependencies, get_dependency_resolver
+from ..models import BuildPhase
+from ..outputcapture import capture_output
 from ....utils import recursive_render
 
 
+def remove_arch_all_from_changes(changes_file):
+    with open(changes_file, 'r') as fp:
+        changes = deb822.Changes(fp)
+
+    for section in ('Checksums-Sha1', 'Checksums-Sha256', 'Files'):
+        if section not in changes:
+            continue
+        changes[section] = [f for f in changes[section] if not f['name'].endswith('_all.deb')]
+
+    with open(changes_file, 'w') as fp:
+        fp.write(changes.dump())
+
+
 class PackageBuilder(object):
+    # Set this if the builder looks at the git history (e.g. to derive the
+    # version), so the checkout isn't left shallow.
+    needs_history = False
+
+    @classmethod
+    def history_needed(cls, builddir):
+        """Whether the checkout in builddir must have its full git history
+
+        Override this if it depends on the code, rather than on the builder."""
+        return cls.needs_history
+
     def __init__(self, basedir, package_source, build_record):
         self.basedir = basedir
         self.build_dependencies = []
         self.runtime_dependencies = []
         self.package_source = package_source
         self.build_record = build_record
+        self._docker_build_args = {}
 
     @property
     def builddir(self):
@@ -32,22 +65,32 @@ class PackageBuilder(object):
 
     def build(self):
         self.build_record.logger.debug('Using %s to build' % (type(self)))
-        package_version = self.package_version
-
-        self.build_record.version = package_version
-        self.build_record.save()
 
-        self.package_source.last_built_version = package_version
-        self.package_source.last_built_name = self.sanitized_package_name
-        self.package_source.save()
-
-        self.build_record.logger.debug('Detecting Build dependencies')
-        self.build_dependencies += self.detect_build_dependencies()
-        self.build_record.logger.info('Build dependencies: %s' % (', '.join(self.build_dependencies)))
+        with self.build_record.phase(BuildPhase.DEPENDENCIES):
+            self.build_record.logger.debug('Detecting Build dependencies')
+            self.build_dependencies += self.detect_build_dependencies()
+            self.build_record.logger.info('Build dependencies: %s' % (', '.join(self.build_dependencies)))
+
+            self.build_record.logger.debug('Detecting run-time dependencies')
+            self.runtime_dependencies += self.detect_runtime_dependencies()
+            self.build_record.logger.info('Runtime dependencies: %s' % (', '.join(self.runtime_dependencies)))
+
+            resolver = get_dependency_resolver()
+            if resolver:
+                self.check_build_dependencies(resolver)
+
+        build_cache = get_build_cache()
+        if build_cache:
+            cache_key = self.cache_key()
+            with self.build_record.phase(BuildPhase.CACHE_RESTORE) as phase:
+                restored = self.restore_from_cache(build_cache, cache_key)
+                if restored:
+                    phase.artifact_bytes = self.artifact_bytes()
+            if restored:
+                return
 
-        self.build_record.logger.debug('Detecting run-time dependencies')
-        self.runtime_dependencies += self.detect_runtime_dependencies()
-        self.build_record.logger.info('Runtime dependencies: %s' % (', '.join(self.runtime_dependencies)))
+        package_version = self.package_version
+        self.stamp(package_version)
 
         self.populate_debian_dir()
 
@@ -55,8 +98,78 @@ class PackageBuilder(object):
 
         self.build_external_dependency_repo_keys()
         self.build_external_dependency_repo_sources()
-        self.docker_build_source_package()
-        self.docker_build_binary_package()
+        with self.build_record.phase(BuildPhase.SOURCE_BUILD) as phase:
+            self.docker_build_source_package()
+            source_bytes = phase.artifact_bytes = self.artifact_bytes()
+        self.build_record.check_superseded()
+        with self.build_record.phase(BuildPhase.BINARY_BUILD) as phase:
+            self.docker_build_binary_packages()
+            phase.artifact_bytes = self.artifact_bytes() - source_bytes
+
+        if build_cache:
+            build_cache.store(cache_key, self.basedir, self.artifacts(),
+                              version=package_version, name=self.sanitized_package_name)
+
+    def artifacts(self):
+        """Names of the packages, .changes files etc. built so far"""
+        return [f for f in os.listdir(self.basedir)
+                if os.path.isfile(os.path.join(self.basedir, f)) and f not in ('keys', 'repos')]
+
+    def artifact_bytes(self):
+        return sum(os.path.getsize(os.path.join(self.basedir, f)) for f in self.artifacts())
+
+    def check_build_dependencies(self, resolver):
+        """Fail right away if the build dependencies can't be installed"""
+        architectures = self.package_source.series.binary_architectures()
+        arch = self.native_architecture if self.native_architecture in architectures else architectures[0]
+        try:
+            resolver.check(self.build_dependencies, self.package_source.series, arch,
+                           getattr(settings, 'BUILDSVC_DOCKER_RELEASE', 'trusty'))
+        except UnsatisfiableBuildDependencies as e:
+            self.build_record.logger.error(str(e))
+            raise
+
+    def stamp(self, package_version, package_name=None):
+        """Record the version being built on the build record and source"""
+        self.build_record.version = package_version
+        self.build_record.save()
+
+        self.package_source.last_built_version = package_version
+        self.package_source.last_built_name = package_name or self.sanitized_package_name
+        self.package_source.save(update_fields=['last_built_version', 'last_built_name'])
+
+    def cache_key(self):
+        """Identifies everything that goes into the build, for the build cache"""
+        extdeps = self.package_source.series.externaldependency_set.all()
+        architectures = self.package_source.series.binary_architectures()
+        arch_dists = getattr(settings, 'BUILDSVC_ARCH_DOCKER_DIST', {})
+        return build_cache_key(self.build_record.sha,
+                               '%s.%s' % (type(self).__module__, type(self).__name__),
+                               self.sanitized_package_name,
+                               self.native_version,
+                               getattr(settings, 'BUILDSVC_DOCKER_DIST', 'ubuntu'),
+                               getattr(settings, 'BUILDSVC_DOCKER_RELEASE', 'trusty'),
+                               sorted('%s=%s' % (arch, arch_dists.get(arch, '')) for arch in architectures),
+                               sorted(self.build_dependencies),
+                               sorted(self.runtime_dependencies),
+                               sorted('%s%s' % (extdep.deb_line, extdep.key or '') for extdep in extdeps))
+
+    def restore_from_cache(self, build_cache, cache_key):
+        """Reuse the artifacts of an identical earlier build, if there is one"""
+        meta = build_cache.lookup(cache_key)
+        if not meta:
+            return False
+
+        # Never publish something older than what's already out there
+        last_built_version = self.package_source.last_built_version
+        if last_built_version and version_compare(meta['version'], last_built_version) < 0:
+            self.build_record.logger.info('Cached build %s is older than %s, rebuilding' % (meta['version'], last_built_version))
+            return False
+
+        self.build_record.logger.info('Build cache hit, reusing %s %s' % (meta['name'], meta['version']))
+        build_cache.restore(cache_key, self.basedir)
+        self.stamp(meta['version'], meta['name'])
+        return True
 
     def build_external_dependency_repo_keys(self):
         """create a file which has all external dependency repos keys"""
@@ -73,33 +186,124 @@ class PackageBuilder(object):
         if extdeps:
             with open(os.path.join(self.basedir, 'repos'), 'w') as fp:
                 for extdep in extdeps:
-                    fp.write(extdep.deb_line)
+                    fp.write(extdep.proxied_deb_line)
 
     def docker_build_source_package(self):
         """Build source package in docker"""
         source_dir = os.path.basename(self.builddir)
-        with open(self.build_record.buildlog(), 'a+') as fp:
-            try:
-                stdout_orig = sys.stdout
-                sys.stdout = fp
-                dbuild.docker_build(build_dir=self.basedir,
-                                    build_type='source',
-                                    source_dir=source_dir,
-                                    build_owner=os.getuid())
-            finally:
-                sys.stdout = stdout_orig
+        with open(self.build_record.buildlog(), 'a+', 1) as fp, capture_output(fp):
+            dbuild.docker_build(build_dir=self.basedir,
+                                build_type='source',
+                                source_dir=source_dir,
+                                build_owner=os.getuid(),
+                                **self.docker_build_args())
 
     def docker_build_binary_package(self):
         """Build binary packages in docker"""
-        with open(self.build_record.buildlog(), 'a+') as fp:
+        with open(self.build_record.buildlog(), 'a+', 1) as fp, capture_output(fp):
+            dbuild.docker_build(build_dir=self.basedir,
+                                build_type='binary',
+                                build_owner=os.getuid(),
+                                **self.docker_build_args())
+
+    def docker_build_binary_packages(self):
+        """Build binary packages for every architecture of the series
+
+        With more than one architecture, each one is built concurrently
+        in a directory of its own and the results are collected in
+        basedir, ready to be published together."""
+        architectures = self.package_source.series.binary_architectures()
+        if architectures == [self.native_architecture]:
+            self.docker_build_binary_package()
+            return
+
+        # Architecture independent packages come from one build only
+        if self.native_architecture in architectures:
+            primary = self.native_architecture
+        else:
+            primary = architectures[0]
+
+        # Everything that needs the database happens up front, since the
+        # workers run in threads of their own.
+        jobs = [(arch, self.docker_build_args(arch), arch == primary) for arch in architectures]
+        self.build_record.logger.info('Building binary packages for %s' % (', '.join(architectures),))
+
+        concurrency = getattr(settings, 'BUILDSVC_BINARY_BUILD_CONCURRENCY', 4)
+        pool = ThreadPool(max(min(concurrency, len(jobs)), 1))
+        with open(self.build_record.buildlog(), 'a+', 1) as fp:
             try:
-                stdout_orig = sys.stdout
-                sys.stdout = fp
-                dbuild.docker_build(build_dir=self.basedir,
-                                    build_type='binary',
-                                    build_owner=os.getuid())
+                pool.map(lambda job: self.docker_build_binary_package_for_arch(*job, logfp=fp), jobs)
             finally:
-                sys.stdout = stdout_orig
+                pool.close()
+                pool.join()
+
+    @property
+    def native_architecture(self):
+        return getattr(settings, 'BUILDSVC_NATIVE_ARCHITECTURE', 'amd64')
+
+    def docker_dist(self, arch):
+        """The docker image to build arch in. None means dbuild's default"""
+        if arch == self.native_architecture:
+            return None
+        dist = getattr(settings, 'BUILDSVC_ARCH_DOCKER_DIST', {}).get(arch)
+        if not dist:
+            raise ValueError('No docker image configured for %s. Add it to BUILDSVC_ARCH_DOCKER_DIST.' % (arch,))
+        return dist
+
+    def docker_build_args(self, arch=None):
+        """Extra arguments telling dbuild which image to build arch in"""
+        arch = arch or self.native_architecture
+        if arch not in self._docker_build_args:
+            dist = self.docker_dist(arch)
+            builder_images = get_builder_images()
+            if builder_images:
+                base_image = '%s:%s' % (dist or getattr(settings, 'BUILDSVC_DOCKER_DIST', 'ubuntu'),
+                                        getattr(settings, 'BUILDSVC_DOCKER_RELEASE', 'trusty'))
+                repository, tag = builder_images.ensure(base_image, self.build_dependencies,
+                                                        self.read_basedir_file('keys'),
+                                                        self.read_basedir_file('repos'),
+                                                        logger=self.build_record.logger)
+                self._docker_build_args[arch] = {'dist': repository, 'release': tag}
+            elif dist:
+                self._docker_build_args[arch] = {'dist': dist}
+            else:
+                self._docker_build_args[arch] = {}
+        return self._docker_build_args[arch]
+
+    def read_basedir_file(self, name):
+        path = os.path.join(self.basedir, name)
+        if not os.path.exists(path):
+            return ''
+        with open(path, 'r') as fp:
+            return fp.read()
+
+    def docker_build_binary_package_for_arch(self, arch, docker_build_args, primary, logfp):
+        """Build the binary packages for one architecture in a directory of its own"""
+        archdir = os.path.join(self.basedir, 'binary-%s' % (arch,))
+        os.mkdir(archdir)
+
+        # The source package, plus the keys and repos files if present
+        for f in os.listdir(self.basedir):
+            if os.path.isfile(os.path.join(self.basedir, f)):
+                shutil.copy2(os.path.join(self.basedir, f), archdir)
+        before = set(os.listdir(archdir))
+
+        with capture_output(logfp):
+            dbuild.docker_build(build_dir=archdir,
+                                build_type='binary',
+                                build_owner=os.getuid(),
+                                **docker_build_args)
+
+        for f in set(os.listdir(archdir)) - before:
+            path = os.path.join(archdir, f)
+            if f.endswith('.changes') and not primary:
+                remove_arch_all_from_changes(path)
+            elif f.endswith('_all.deb') and not primary:
+                continue
+            if os.path.isfile(path):
+                shutil.move(path, self.basedir)
+
+        shutil.rmtree(archdir)
 
     def detect_runtime_dependencies(self):
         return []
@@ -193,7 +397,8 @@ class PackageBuilder(object):
         return None
 
     @classmethod
-    def is_suitable(cls, path):
+    def is_suitable(cls, manifest):
+        """Whether this builder can build the tree described by manifest (a SourceManifest)"""
         return False
 
 
@@ -205,9 +410,10 @@ class PackageBuilderRegistry(object):
         cls.builders.append(builder)
 
 
-def choose_builder(path):
+def choose_builder(path, sha=None):
+    manifest = SourceManifest.for_checkout(path, sha)
     for builder in PackageBuilderRegistry.builders:
-        if builder.is_suitable(path):
+        if builder.is_suitable(manifest):
             return builder
 
 from . import debian  # noqa
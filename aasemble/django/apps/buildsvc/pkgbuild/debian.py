@@ -1,22 +1,56 @@
 from __future__ import absolute_import
 
 import os.path
+from collections import namedtuple
 
+import debian.changelog
 import debian.deb822
 
 from ..pkgbuild import PackageBuilder, PackageBuilderRegistry
 from ....utils import run_cmd
 
+DebianMetadata = namedtuple('DebianMetadata', ['source', 'version'])
+
+
+def changelog_version(builddir):
+    """Version of the most recent entry in debian/changelog"""
+    try:
+        with open(os.path.join(builddir, 'debian', 'changelog'), 'r') as fp:
+            changelog = debian.changelog.Changelog(fp, max_blocks=1)
+        for block in changelog:
+            if block.version:
+                return str(block.version)
+    except (IOError, debian.changelog.ChangelogParseError):
+        pass
+
+    # Leave anything out of the ordinary to dpkg
+    cmd = ['dpkg-parsechangelog', '--show-field', 'Version']
+    return run_cmd(cmd, cwd=builddir).decode('utf-8').strip()
+
+
+def read_debian_metadata(builddir):
+    with open(os.path.join(builddir, 'debian', 'control'), 'r') as fp:
+        control = debian.deb822.Deb822(fp)
+    return DebianMetadata(source=control['Source'], version=changelog_version(builddir))
+
 
 class DebianBuilder(PackageBuilder):
+    _metadata = None
+
     @classmethod
-    def is_suitable(cls, path):
-        return os.path.isdir(os.path.join(path, 'debian'))
+    def is_suitable(cls, manifest):
+        return manifest.has_dir('debian')
+
+    @property
+    def metadata(self):
+        """Source package name and version from debian/, read once per build"""
+        if self._metadata is None:
+            self._metadata = read_debian_metadata(self.builddir)
+        return self._metadata
 
     @property
     def native_version(self):
-        cmd = ['dpkg-parsechangelog', '--show-field', 'Version']
-        v = run_cmd(cmd, cwd=self.builddir).strip()
+        v = self.metadata.version
         if ':' in v:
             v = v.split(':')[1]
         if '-' in v:
@@ -25,8 +59,7 @@ class DebianBuilder(PackageBuilder):
 
     @property
     def package_name(self):
-        ctrl = debian.deb822.Deb822(open(os.path.join(self.builddir, 'debian/control'), 'r'))
-        return ctrl['Source']
+        return self.metadata.source
 
     def populate_debian_dir(self):
         pass
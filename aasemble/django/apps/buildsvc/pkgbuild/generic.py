@@ -3,7 +3,7 @@ from ..pkgbuild import PackageBuilder, PackageBuilderRegistry
 
 class GenericBuilder(PackageBuilder):
     @classmethod
-    def is_suitable(cls, path):
+    def is_suitable(cls, manifest):
         return True
 
 
@@ -1,5 +1,3 @@
-import os.path
-
 from ..pkgbuild import PackageBuilder, PackageBuilderRegistry
 
 
@@ -8,11 +6,8 @@ class GolangBuilder(PackageBuilder):
         return ['golang-go'] + super(GolangBuilder, self).detect_build_dependencies()
 
     @classmethod
-    def is_suitable(cls, path):
-        for root, dirs, files in os.walk(path):
-            if any([f.endswith('.go') for f in files]):
-                return True
-        return False
+    def is_suitable(cls, manifest):
+        return manifest.has_extension('.go')
 
 
 PackageBuilderRegistry.register_builder(GolangBuilder)
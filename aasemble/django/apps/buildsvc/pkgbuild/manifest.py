@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+
+import os
+import os.path
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+VCS_DIRS = frozenset(['.git', '.hg', '.svn', '.bzr'])
+
+
+class SourceManifest(object):
+    """What's in a source tree, gathered in one walk of it
+
+    Builders decide whether they're suitable for a tree based on this,
+    rather than each of them looking through the tree on its own. VCS
+    metadata directories aren't looked into."""
+
+    def __init__(self, path, files=(), dirs=(), extensions=None):
+        self.path = path
+        self.files = frozenset(files)
+        self.dirs = frozenset(dirs)
+        self.extensions = dict(extensions or {})
+
+    @classmethod
+    def scan(cls, path):
+        files, dirs, extensions = set(), set(), Counter()
+        for root, dirnames, filenames in os.walk(path):
+            dirnames[:] = [d for d in dirnames if d not in VCS_DIRS]
+            if root == path:
+                files.update(filenames)
+                dirs.update(dirnames)
+            for f in filenames:
+                ext = os.path.splitext(f)[1]
+                if ext:
+                    extensions[ext] += 1
+        return cls(path, files, dirs, extensions)
+
+    @classmethod
+    def for_checkout(cls, path, sha=None):
+        """The manifest of a checkout of sha, scanned only once per sha"""
+        if not sha:
+            return cls.scan(path)
+
+        key = 'buildsvc_source_manifest_%s' % (sha,)
+        data = cache.get(key)
+        if data is not None:
+            return cls(path, **data)
+
+        manifest = cls.scan(path)
+        cache.set(key, manifest.as_dict(), getattr(settings, 'BUILDSVC_SOURCE_MANIFEST_TTL', 86400))
+        return manifest
+
+    def as_dict(self):
+        return {'files': sorted(self.files),
+                'dirs': sorted(self.dirs),
+                'extensions': self.extensions}
+
+    def has_file(self, name):
+        """Whether there's a file called name at the top of the tree"""
+        return name in self.files
+
+    def has_dir(self, name):
+        """Whether there's a directory called name at the top of the tree"""
+        return name in self.dirs
+
+    def has_extension(self, ext):
+        """Whether there's a file ending in ext anywhere in the tree"""
+        return self.extensions.get(ext, 0) > 0
@@ -1,35 +1,141 @@
 import os.path
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+
+from six.moves import configparser
 
 from ..pkgbuild import PackageBuilder, PackageBuilderRegistry
 from ....utils import run_cmd
 
+PYPROJECT_FIELD = re.compile(r'^(name|version)\s*=\s*["\']([^"\']+)["\']\s*(#.*)?$')
+
+# Tools that derive the version from git tags and commit counts
+VCS_VERSIONING = re.compile(r'\bpbr\b|setuptools[_-]scm|use_scm_version')
+
+
+class InvalidPackageMetadata(Exception):
+    pass
+
+
+def read_setup_cfg_metadata(path):
+    """Name and version from the [metadata] section of setup.cfg"""
+    parser = configparser.RawConfigParser()
+    try:
+        parser.read(os.path.join(path, 'setup.cfg'))
+        return dict((k, v) for k, v in parser.items('metadata') if k in ('name', 'version'))
+    except (configparser.Error, UnicodeDecodeError):
+        return {}
+
+
+def read_pyproject_metadata(path):
+    """Name and version from the [project] table of pyproject.toml
+
+    Only literal strings are understood, which is all we need."""
+    metadata = {}
+    section = None
+    try:
+        with open(os.path.join(path, 'pyproject.toml'), 'r') as fp:
+            for line in fp:
+                line = line.strip()
+                if line.startswith('['):
+                    section = line.strip('[] ')
+                elif section == 'project':
+                    m = PYPROJECT_FIELD.match(line)
+                    if m:
+                        metadata[m.group(1)] = m.group(2)
+    except (IOError, OSError):
+        pass
+    return metadata
+
+
+def read_static_metadata(path):
+    """Name and version of the package at path, if they're declared statically"""
+    for reader in (read_setup_cfg_metadata, read_pyproject_metadata):
+        metadata = reader(path)
+        version = metadata.get('version', '')
+        # e.g. "attr: mypkg.__version__" needs the code to be imported
+        if metadata.get('name') and version and ':' not in version:
+            return {'name': metadata['name'], 'version': version}
+
+
+def uses_vcs_versioning(path):
+    """Whether the package at path gets its version from git (pbr, setuptools_scm)"""
+    for filename in ('setup.py', 'setup.cfg', 'pyproject.toml'):
+        try:
+            with open(os.path.join(path, filename), 'r') as fp:
+                if VCS_VERSIONING.search(fp.read()):
+                    return True
+        except (IOError, OSError, UnicodeDecodeError):
+            pass
+    return False
+
 
 class PythonBuilder(PackageBuilder):
+    _metadata = None
+
+    @classmethod
+    def is_suitable(cls, manifest):
+        return manifest.has_file('setup.py')
+
     @classmethod
-    def is_suitable(cls, path):
-        return os.path.exists(os.path.join(path, 'setup.py'))
+    def history_needed(cls, builddir):
+        # A shallow checkout would give pbr and setuptools_scm the wrong version
+        return uses_vcs_versioning(builddir)
 
-    def retry_if_has_newlines(self, cmd, logger):
+    def retry_if_has_noise(self, cmd, lines, logger):
         """Sometimes the first run will have noise in it"""
         def run_it():
-            return run_cmd(cmd, cwd=self.builddir, discard_stderr=True, logger=logger).strip()
+            return run_cmd(cmd, cwd=self.builddir, discard_stderr=True, logger=logger).decode('utf-8').strip().split('\n')
 
         out = run_it()
 
-        if '\n' in out:
+        if len(out) > lines:
             out = run_it()
 
-        return out
+        return out[-lines:]
+
+    @property
+    def metadata(self):
+        """Name and version of the package
+
+        They're read from setup.cfg or pyproject.toml if they're declared
+        there, and otherwise from a single run of setup.py. Either way,
+        that happens once per build, and once per sha for as long as the
+        cache keeps it."""
+        if self._metadata is None:
+            sha = self.build_record.sha
+            key = sha and 'buildsvc_python_metadata_%s' % (sha,)
+            metadata = key and cache.get(key)
+            if not metadata:
+                metadata = read_static_metadata(self.builddir)
+                if not metadata:
+                    metadata = self.read_setup_py_metadata()
+                if key:
+                    cache.set(key, metadata, getattr(settings, 'BUILDSVC_SOURCE_METADATA_TTL', 86400))
+            self._metadata = metadata
+        return self._metadata
+
+    def read_setup_py_metadata(self):
+        output = self.retry_if_has_noise(['python', 'setup.py', '--name', '--version'], 2,
+                                         logger=self.build_record.logger)
+        if len(output) < 2 or not all(line.strip() for line in output):
+            msg = ('setup.py --name --version should print the name and version of the package, '
+                   'but printed: %r' % ('\n'.join(output),))
+            self.build_record.logger.error(msg)
+            raise InvalidPackageMetadata(msg)
+
+        name, version = output
+        return {'name': name.strip(), 'version': version.strip()}
 
     @property
     def native_version(self):
-        return self.retry_if_has_newlines(['python', 'setup.py', '--version'],
-                                          logger=self.build_record.logger)
+        return self.metadata['version']
 
     @property
     def package_name(self):
-        return self.retry_if_has_newlines(['python', 'setup.py', '--name'],
-                                          logger=self.build_record.logger)
+        return self.metadata['name']
 
     @property
     def binary_pkg_name(self):
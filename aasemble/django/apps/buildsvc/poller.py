@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from .utils import git_remote_key, git_url_host
+from ...exceptions import CommandFailed
+from ...utils import run_cmd
+
+LOG = logging.getLogger(__name__)
+
+
+def parse_ls_remote(output):
+    """Turn the output of git ls-remote into a {ref: sha} dict"""
+    if isinstance(output, bytes):
+        output = output.decode('utf-8')
+
+    refs = {}
+    for line in output.splitlines():
+        if '\t' not in line:
+            continue
+        sha, ref = line.split('\t', 1)
+        refs[ref.strip()] = sha.strip()
+    return refs
+
+
+def ls_remote(git_url, patterns=None, heads=False):
+    cmd = ['git', 'ls-remote']
+    if heads:
+        cmd += ['--heads']
+    cmd += [git_url] + list(patterns or [])
+    return parse_ls_remote(run_cmd(cmd, discard_stderr=True))
+
+
+def bulk_update(sources, fields):
+    """Write the given fields of all the sources in a single query"""
+    if not sources:
+        return 0
+
+    from .models import PackageSource
+    values = {}
+    for field in fields:
+        whens = [When(id=ps.id, then=Value(getattr(ps, field))) for ps in sources]
+        values[field] = Case(*whens, output_field=PackageSource._meta.get_field(field))
+    return PackageSource.objects.filter(id__in=[ps.id for ps in sources]).update(**values)
+
+
+def remote_host(git_url):
+    return git_url_host(git_url) or 'localhost'
+
+
+class PollStats(object):
+    def __init__(self, remotes=0, sources=0, changed=0, failed=0, elapsed=0.0):
+        self.remotes = remotes
+        self.sources = sources
+        self.changed = changed
+        self.failed = failed
+        self.elapsed = elapsed
+
+    @property
+    def throughput(self):
+        """Remotes checked per second"""
+        if not self.elapsed:
+            return 0.0
+        return self.remotes / self.elapsed
+
+    def __str__(self):
+        return ('Polled %d remotes (%d sources) in %.2fs (%.1f remotes/s). '
+                '%d sources changed, %d remotes failed' %
+                (self.remotes, self.sources, self.elapsed, self.throughput,
+                 self.changed, self.failed))
+
+
+class Poller(object):
+    """Checks the refs of many remotes concurrently
+
+    At most `concurrency` ls-remotes run at any one time, and no more than
+    the configured limit for any single host, so big hosting sites and
+    internal git servers alike are never hammered."""
+
+    def __init__(self, concurrency=None, host_limits=None, default_host_limit=None):
+        if concurrency is None:
+            concurrency = getattr(settings, 'BUILDSVC_POLL_CONCURRENCY', 16)
+        if host_limits is None:
+            host_limits = getattr(settings, 'BUILDSVC_POLL_HOST_CONCURRENCY', {})
+        if default_host_limit is None:
+            default_host_limit = getattr(settings, 'BUILDSVC_POLL_DEFAULT_HOST_CONCURRENCY', 4)
+
+        self.concurrency = max(concurrency, 1)
+        self.host_limits = host_limits
+        self.default_host_limit = max(default_host_limit, 1)
+        self.stats = None
+
+    def host_limit(self, host):
+        return max(self.host_limits.get(host, self.default_host_limit), 1)
+
+    def fetch_refs(self, git_urls):
+        """Run ls-remote for every url. Returns a {git_url: refs} dict
+
+        Remotes that could not be listed are left out of the result."""
+        pending = list(git_urls)
+        running = defaultdict(int)
+        results = {}
+        cond = threading.Condition()
+
+        def next_url():
+            for idx, git_url in enumerate(pending):
+                host = remote_host(git_url)
+                if running[host] < self.host_limit(host):
+                    running[host] += 1
+                    return pending.pop(idx)
+
+        def worker():
+            while True:
+                with cond:
+                    git_url = next_url()
+                    while git_url is None and pending:
+                        cond.wait()
+                        git_url = next_url()
+                    if git_url is None:
+                        return
+
+                try:
+                    results[git_url] = ls_remote(git_url, heads=True)
+                except CommandFailed:
+                    LOG.warning('Failed to list refs of %s' % (git_url,), exc_info=True)
+                finally:
+                    with cond:
+                        running[remote_host(git_url)] -= 1
+                        cond.notify_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(min(self.concurrency, len(pending)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def record_revision(self, ps, sha):
+        """Store sha as the last seen revision of ps, unless it has moved on
+
+        The write only goes through if the revision is still the one ps
+        was loaded with, so a webhook or another poller that got there
+        first isn't overwritten with an older sha, nor is the same change
+        built twice. Returns whether the write went through."""
+        from .models import PackageSource
+        sources = PackageSource.objects.filter(id=ps.id)
+        if ps.last_seen_revision is None:
+            sources = sources.filter(last_seen_revision__isnull=True)
+        else:
+            sources = sources.filter(last_seen_revision=ps.last_seen_revision)
+        if not sources.update(last_seen_revision=sha):
+            return False
+        ps.last_seen_revision = sha
+        return True
+
+    def poll(self, sources):
+        """Poll a number of sources, running just one ls-remote per remote
+
+        Returns the list of sources whose branch has moved. Their
+        last_seen_revision has already been updated. The poll schedule
+        of all the sources is written in one go."""
+        started = time.time()
+
+        # Sources whose urls differ only in spelling share a remote, as
+        # long as they reach it with the same credentials
+        by_remote = defaultdict(list)
+        remote_urls = {}
+        for ps in sources:
+            remote = git_remote_key(ps.git_url)
+            by_remote[remote].append(ps)
+            remote_urls.setdefault(remote, ps.git_url)
+
+        refs_by_remote = self.fetch_refs(remote_urls.values())
+
+        now = timezone.now()
+        polled = []
+        changed = []
+        for remote, remote_sources in by_remote.items():
+            git_url = remote_urls[remote]
+            refs = refs_by_remote.get(git_url, {})
+            for ps in remote_sources:
+                sha = refs.get('refs/heads/%s' % (ps.branch,))
+                if git_url in refs_by_remote and not sha:
+                    LOG.info('Branch %s not found in %s' % (ps.branch, git_url))
+
+                moved = sha and sha != ps.last_seen_revision and self.record_revision(ps, sha)
+                if moved:
+                    changed.append(ps)
+                ps.schedule_next_poll(changed=bool(moved), now=now)
+                polled.append(ps)
+
+        bulk_update(polled, ['poll_interval', 'next_poll_at'])
+
+        self.stats = PollStats(remotes=len(by_remote),
+                               sources=sum(len(srcs) for srcs in by_remote.values()),
+                               changed=len(changed),
+                               failed=len(by_remote) - len(refs_by_remote),
+                               elapsed=time.time() - started)
+        LOG.info(str(self.stats))
+        return changed
+
+
+def poll_sources(sources):
+    return Poller().poll(sources)
@@ -0,0 +1,97 @@
+import gzip
+import json
+import logging
+import os
+import os.path
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+LOG = logging.getLogger(__name__)
+
+
+def expired_builds(repository, now=None):
+    """Ids of the builds of repository that its retention policy lets go
+
+    The most recent retention_count builds of each source are kept, as is
+    anything started within the last retention_days days. Skipped builds
+    don't count towards retention_count. Builds that are still running
+    are kept too, unless they started longer ago than a build slot lasts,
+    in which case their worker has gone away."""
+    from .models import BuildRecord
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=repository.retention_days)
+    stale = now - timedelta(seconds=getattr(settings, 'BUILDSVC_BUILD_SLOT_TTL', 4 * 3600))
+
+    expired = []
+    for source in repository.sources:
+        builds = BuildRecord.objects.filter(source=source)
+        keep = list(builds.exclude(status=BuildRecord.SKIPPED)
+                          .order_by('-id').values_list('id', flat=True)[:repository.retention_count])
+        old = (builds.filter(build_started__lt=cutoff)
+                     .exclude(id__in=keep)
+                     .exclude(status=BuildRecord.BUILDING, build_started__gte=stale))
+        expired += old.order_by('id').values_list('id', flat=True)
+    return expired
+
+
+def delete_buildlog(build):
+    """Delete the log of build, compressed or not. Returns the bytes freed"""
+    path = build.buildlog()
+    freed = 0
+    for p in (path, path + '.gz'):
+        try:
+            size = os.path.getsize(p)
+            os.unlink(p)
+        except OSError:
+            continue
+        freed += size
+    return freed
+
+
+def archive_path(repository):
+    return os.path.join(repository.basedir, 'build-archive.jsonl.gz')
+
+
+def archive_builds(repository, builds):
+    """Append a summary of each of builds to the repository's build archive
+
+    Each batch is added as a gzip member of its own, which zcat and
+    gzip.open read back as one stream."""
+    with gzip.open(archive_path(repository), 'ab') as fp:
+        for build in builds:
+            record = {'uuid': str(build.uuid),
+                      'source': build.source.long_name,
+                      'build_counter': build.build_counter,
+                      'version': build.version,
+                      'sha': build.sha,
+                      'status': build.status,
+                      'build_started': build.build_started.isoformat()}
+            fp.write((json.dumps(record, sort_keys=True) + '\n').encode('utf-8'))
+
+
+def prune_builds(repository, now=None, batch_size=None):
+    """Delete the logs of expired builds and archive their records
+
+    Builds are handled in batches, so no one delete holds locks on the
+    table for long. Returns the number of builds pruned and the bytes of
+    logs freed."""
+    from .models import BuildRecord
+    if batch_size is None:
+        batch_size = getattr(settings, 'BUILDSVC_PRUNE_BATCH_SIZE', 500)
+
+    expired = expired_builds(repository, now)
+    pruned = freed = 0
+    for i in range(0, len(expired), batch_size):
+        batch = list(BuildRecord.objects.filter(id__in=expired[i:i + batch_size])
+                                        .select_related('source__series__repository__user'))
+        for build in batch:
+            freed += delete_buildlog(build)
+        archive_builds(repository, batch)
+        BuildRecord.objects.filter(id__in=[build.id for build in batch]).delete()
+        pruned += len(batch)
+
+    if pruned:
+        LOG.info('Pruned %d builds of %s, freeing %d bytes of logs' % (pruned, repository, freed))
+    return pruned, freed
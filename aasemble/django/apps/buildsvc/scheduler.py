@@ -0,0 +1,114 @@
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+LOG = logging.getLogger(__name__)
+
+
+def _requests():
+    from .models import BuildRequest
+    return BuildRequest.objects.select_related('source__series__repository')
+
+
+class Scheduler(object):
+    """Hands queued builds to workers, subject to concurrency caps
+
+    No more than `max_builds` builds run at once, no more than
+    `per_repository` for any one repository, and no more than `per_user`
+    for all of a user's repositories together. Higher priority requests go
+    first. Among requests of equal priority, the user with the fewest
+    builds running goes first, so a user with a lot of sources can't
+    crowd everyone else out."""
+
+    def __init__(self, max_builds=None, per_repository=None, per_user=None):
+        if max_builds is None:
+            max_builds = getattr(settings, 'BUILDSVC_MAX_CONCURRENT_BUILDS', 8)
+        if per_repository is None:
+            per_repository = getattr(settings, 'BUILDSVC_MAX_BUILDS_PER_REPOSITORY', 2)
+        if per_user is None:
+            per_user = getattr(settings, 'BUILDSVC_MAX_BUILDS_PER_USER', 4)
+
+        self.max_builds = max_builds
+        self.per_repository = per_repository
+        self.per_user = per_user
+
+    def has_room(self, req, per_repository, per_user):
+        if per_repository[req.repository_id] >= self.per_repository:
+            return False
+        return per_user[req.user_id] < self.per_user
+
+    def reap(self, now=None):
+        """Free the slots of builds whose worker has gone away"""
+        from .models import BuildRequest
+        ttl = getattr(settings, 'BUILDSVC_BUILD_SLOT_TTL', 4 * 3600)
+        expired = (now or timezone.now()) - timedelta(seconds=ttl)
+        BuildRequest.objects.filter(state=BuildRequest.DISPATCHED, dispatched__lte=expired).delete()
+
+    def dispatch(self, now=None):
+        """Claim build slots for as many queued requests as the caps allow
+
+        Returns the claimed requests. The caller starts the builds."""
+        from .models import BuildRequest
+        now = now or timezone.now()
+        self.reap(now)
+
+        running = list(_requests().filter(state=BuildRequest.DISPATCHED))
+        per_repository = Counter(r.repository_id for r in running)
+        per_user = Counter(r.user_id for r in running)
+
+        slots = self.max_builds - len(running)
+        if slots <= 0:
+            return []
+
+        queued = list(_requests().filter(state=BuildRequest.QUEUED, not_before__lte=now))
+
+        dispatched = []
+        while slots > 0 and queued:
+            eligible = [r for r in queued if self.has_room(r, per_repository, per_user)]
+            if not eligible:
+                break
+
+            req = min(eligible, key=lambda r: (-r.priority, per_user[r.user_id], r.created))
+            queued.remove(req)
+
+            if not req.claim(now):
+                continue
+
+            per_repository[req.repository_id] += 1
+            per_user[req.user_id] += 1
+            slots -= 1
+            dispatched.append(req)
+
+        return dispatched
+
+
+def queue_stats(repositories=None, now=None):
+    """Depth of the build queue and how long requests have been waiting
+
+    Per-repository figures are given for the given repositories only."""
+    from .models import BuildRequest
+    now = now or timezone.now()
+
+    requests = list(_requests().all())
+    queued = [r for r in requests if r.state == BuildRequest.QUEUED]
+    waits = [(now - r.created).total_seconds() for r in queued]
+
+    stats = {'queued': len(queued),
+             'running': len(requests) - len(queued),
+             'oldest_wait': max(waits) if waits else 0,
+             'mean_wait': sum(waits) / len(waits) if waits else 0,
+             'repositories': []}
+
+    if repositories is not None:
+        for repository in repositories:
+            mine = [r for r in requests if r.repository_id == repository.id]
+            stats['repositories'].append({
+                'repository': str(repository),
+                'queued': len([r for r in mine if r.state == BuildRequest.QUEUED]),
+                'running': len([r for r in mine if r.state == BuildRequest.DISPATCHED]),
+            })
+
+    return stats
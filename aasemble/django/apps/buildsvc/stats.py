@@ -0,0 +1,45 @@
+import math
+
+from django.conf import settings
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, pct):
+    """The pct'th percentile of values, by the nearest rank method"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def summarize(durations):
+    summary = {'count': len(durations),
+               'mean': sum(durations) / len(durations) if durations else None}
+    for pct in PERCENTILES:
+        summary['p%d' % (pct,)] = percentile(durations, pct)
+    return summary
+
+
+def phase_stats(repositories, limit=None):
+    """Duration percentiles of each build phase, per repository
+
+    Only the most recent `limit` builds of each repository that got as far
+    as the phase in question, and got through it, are taken into account."""
+    from .models import BuildPhase
+    if limit is None:
+        limit = getattr(settings, 'BUILDSVC_BUILD_STATS_WINDOW', 100)
+
+    stats = []
+    for repository in repositories:
+        phases = BuildPhase.objects.filter(build__source__series__repository=repository, succeeded=True)
+        summaries = {}
+        for name, label in BuildPhase.NAME_CHOICES:
+            recent = phases.filter(name=name).order_by('-started')[:limit]
+            durations = list(recent.values_list('duration', flat=True))
+            if durations:
+                summaries[name] = summarize(durations)
+
+        stats.append({'repository': str(repository), 'phases': summaries})
+    return stats
@@ -1,30 +1,165 @@
+import logging
+from datetime import timedelta
+
 from celery import shared_task
 
+from django.conf import settings
+from django.utils import timezone
+
+LOG = logging.getLogger(__name__)
+
+
+def reprepro_lease_key(repository_id, *args):
+    return 'reprepro:%d:%s' % (repository_id, ' '.join(args))
+
+
+def build_lease_key(package_source_id):
+    return 'build:%d' % (package_source_id,)
+
+
+def poll_lease_key(package_source_id):
+    return 'poll:%d' % (package_source_id,)
+
+
+def schedule_reprepro(repository_id, *args):
+    from .models import TaskLease
+    if TaskLease.acquire(reprepro_lease_key(repository_id, *args)):
+        reprepro.delay(repository_id, *args)
+        return True
+    return False
+
+
+def schedule_build(package_source_id, sha=None, countdown=0, priority=None):
+    """Queue a build unless one is already pending for this source
+
+    With a countdown, the build waits that long before starting, so
+    anything pushed in the meantime is built along with it. If a build is
+    already pending, it takes on the higher of the two priorities."""
+    from .models import BuildRequest, TaskLease
+    if priority is None:
+        priority = BuildRequest.POLL
+    not_before = timezone.now() + timedelta(seconds=countdown)
+
+    queued = TaskLease.acquire(build_lease_key(package_source_id))
+    if queued:
+        BuildRequest.enqueue(package_source_id, sha, priority, not_before)
+    else:
+        BuildRequest.promote(package_source_id, sha, priority, not_before)
+        LOG.info('Build of source %d already pending' % (package_source_id,))
+
+    if not countdown:
+        dispatch_builds.delay()
+    return queued
+
+
+def schedule_poll(package_source_id):
+    from .models import TaskLease
+    if TaskLease.acquire(poll_lease_key(package_source_id)):
+        poll_one.delay(package_source_id)
+        return True
+    return False
+
 
 @shared_task(ignore_result=True)
 def reprepro(repository_id, *args):
-    from .models import Repository
-    r = Repository.objects.get(id=repository_id)
-    r._reprepro(*args)
+    from .models import Repository, TaskLease
+    try:
+        r = Repository.objects.get(id=repository_id)
+        r._reprepro(*args)
+    finally:
+        TaskLease.release(reprepro_lease_key(repository_id, *args))
+
+
+@shared_task(ignore_result=True)
+def dispatch_builds():
+    from .models import TaskLease
+    from .scheduler import Scheduler
+    if not TaskLease.acquire('dispatch_builds', ttl=60):
+        return
+
+    try:
+        for req in Scheduler().dispatch():
+            # The build is no longer pending, so new commits may queue another one
+            TaskLease.release(build_lease_key(req.source_id))
+            build.delay(req.source_id, req.sha, req.id)
+    finally:
+        TaskLease.release('dispatch_builds')
 
 
 @shared_task(ignore_result=True)
-def build(package_source_id):
-    from .models import PackageSource
-    ps = PackageSource.objects.get(id=package_source_id)
-    ps.build_real()
+def build(package_source_id, sha=None, request_id=None):
+    from .models import BuildRequest, PackageSource, TaskLease
+    if request_id is None:
+        # Queued directly rather than through the scheduler
+        TaskLease.release(build_lease_key(package_source_id))
+
+    try:
+        ps = PackageSource.objects.get(id=package_source_id)
+        triggers = ps.take_pending_triggers()
+
+        # Revisions that showed up while we were queued were coalesced into
+        # this build, so build the newest one.
+        if sha and ps.last_seen_revision and ps.last_seen_revision != sha:
+            LOG.info('%s moved from %s to %s while queued' % (ps, sha, ps.last_seen_revision))
+            sha = ps.last_seen_revision
+
+        # Builds asked for by hand are rebuilds, so they always go ahead
+        manual = BuildRequest.objects.filter(id=request_id, priority__gte=BuildRequest.MANUAL).exists()
+        if sha and not manual and ps.revision_already_built(sha):
+            LOG.info('Skipping build of %s at %s, it has already been built' % (ps, sha))
+            ps.skip_build(sha, triggers=max(triggers, 1))
+            return
+
+        ps.build_real(sha=sha, triggers=max(triggers, 1))
+    finally:
+        if request_id is not None:
+            BuildRequest.objects.filter(id=request_id).delete()
+            dispatch_builds.delay()
 
 
 @shared_task(ignore_result=True)
 def poll_one(package_source_id):
-    from .models import PackageSource
-    ps = PackageSource.objects.get(id=package_source_id)
-    if ps.poll():
-        ps.build()
+    from .models import PackageSource, TaskLease
+    try:
+        ps = PackageSource.objects.get(id=package_source_id)
+        if ps.poll():
+            ps.build()
+    finally:
+        TaskLease.release(poll_lease_key(package_source_id))
 
 
 @shared_task(ignore_result=True)
 def poll_all():
-    from .models import PackageSource
-    for ps in PackageSource.objects.filter(webhook_registered=False):
-        poll_one.delay(ps.id)
+    from .models import PackageSource, TaskLease
+    from .poller import poll_sources
+
+    TaskLease.reap()
+
+    # Don't let poll cycles pile up if one takes longer than the beat interval
+    if not TaskLease.acquire('poll_all', ttl=getattr(settings, 'BUILDSVC_POLL_ALL_LEASE_TTL', 300)):
+        return
+
+    try:
+        for ps in poll_sources(PackageSource.due_for_polling()):
+            ps.build()
+    finally:
+        TaskLease.release('poll_all')
+
+
+@shared_task(ignore_result=True)
+def prune_builds():
+    from .models import Repository, TaskLease
+    from .retention import prune_builds
+
+    if not TaskLease.acquire('prune_builds', ttl=getattr(settings, 'BUILDSVC_PRUNE_LEASE_TTL', 3600)):
+        return
+
+    try:
+        pruned = freed = 0
+        for repository in Repository.objects.all():
+            p, f = prune_builds(repository)
+            pruned += p
+            freed += f
+        LOG.info('Pruned %d builds in total, freeing %d bytes of logs' % (pruned, freed))
+    finally:
+        TaskLease.release('prune_builds')
@@ -1,5 +1,77 @@
+import re
+
+from six.moves.urllib.parse import urlparse
+
 from . import github
 
+SCP_LIKE_URL = re.compile(r'^(?:(?P<user>[^@/]+)@)?(?P<host>[^:/]+):(?P<path>[^/].*)$')
+
+DEFAULT_PORTS = (22, 80, 443, 9418)
+
+CASE_INSENSITIVE_HOSTS = ('github.com',)
+
+
+def _parse_git_url(git_url):
+    """urlparse() a git remote url, scp-like addresses and plain paths included"""
+    git_url = git_url.strip()
+
+    if '://' not in git_url:
+        match = SCP_LIKE_URL.match(git_url)
+        if match:
+            user = match.group('user')
+            git_url = 'ssh://%s%s/%s' % (user and '%s@' % (user,) or '',
+                                         match.group('host'), match.group('path'))
+        else:
+            git_url = 'file://%s' % (git_url,)
+
+    return urlparse(git_url)
+
+
+def git_url_host(git_url):
+    """The host a git remote lives on, or None for local repositories"""
+    return _parse_git_url(git_url).hostname
+
+
+def normalize_git_url(git_url):
+    """Reduce a git remote url to a canonical identity
+
+    Variants of the same remote (http vs https vs ssh, trailing slashes
+    or .git, different case on GitHub) all end up as e.g.
+    github.com/owner/repo. Local repositories keep their file:// prefix.
+
+    Credentials are dropped, so this is what to match remotes by, but
+    not what to share clones or ls-remote results by. See git_remote_key."""
+    parsed = _parse_git_url(git_url)
+
+    path = parsed.path.rstrip('/')
+    if path.endswith('.git'):
+        path = path[:-len('.git')].rstrip('/')
+
+    if parsed.scheme.lower() == 'file':
+        return 'file://%s' % (path,)
+
+    host = (parsed.hostname or '').lower()
+    if parsed.port and parsed.port not in DEFAULT_PORTS:
+        host = '%s:%d' % (host, parsed.port)
+
+    if host in CASE_INSENSITIVE_HOSTS:
+        path = path.lower()
+
+    return '%s/%s' % (host, path.lstrip('/'))
+
+
+def git_remote_key(git_url):
+    """Like normalize_git_url, but keeps any credentials in the url
+
+    Whatever is fetched through a url with credentials must only be
+    reused for urls with the very same credentials, or a private
+    repository would leak to sources that have no access to it."""
+    netloc = _parse_git_url(git_url).netloc
+    canonical = normalize_git_url(git_url)
+    if '@' in netloc:
+        return '%s@%s' % (netloc.rsplit('@', 1)[0], canonical)
+    return canonical
+
 
 def sync_sources_from_github(user):
     from ..models import GithubRepository
@@ -1,8 +1,13 @@
+import gzip
+import os.path
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
-from django.shortcuts import render
+from django.http import FileResponse, Http404, HttpResponseRedirect
+from django.shortcuts import get_object_or_404, render
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_safe
 
 from .models import BuildRecord, PackageSource, PackageSourceForm, Repository, Series
 
@@ -57,6 +62,52 @@ def builds(request):
     return render(request, 'buildsvc/html/builds.html', {'builds': builds})
 
 
+def accepts_gzip(request):
+    """Whether Accept-Encoding allows gzip, minding q-values (gzip;q=0 means no)"""
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', 'x-gzip'):
+            continue
+
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        return q > 0
+    return False
+
+
+@require_safe
+def buildlog(request, build_uuid):
+    """Serve a build log
+
+    Logs are stored compressed once the build is over. They're sent as they
+    are to clients that accept gzip, and decompressed on the fly for the
+    rest."""
+    build = get_object_or_404(BuildRecord, uuid=build_uuid)
+    path, compressed = build.stored_buildlog()
+    if not os.path.exists(path):
+        raise Http404
+
+    content_type = 'text/plain; charset=utf-8'
+    if not compressed:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Content-Length'] = os.path.getsize(path)
+    elif accepts_gzip(request):
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Content-Length'] = os.path.getsize(path)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = FileResponse(gzip.open(path, 'rb'), content_type=content_type)
+
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
 @login_required
 def repositories(request):
     repositories = Repository.lookup_by_user(request.user)
@@ -0,0 +1,209 @@
+import logging
+import os
+import os.path
+import shutil
+import socket
+import struct
+import tempfile
+
+from django.conf import settings
+
+from six.moves.urllib.error import HTTPError, URLError
+from six.moves.urllib.parse import urlparse
+from six.moves.urllib.request import urlopen
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_ALLOWED_HOSTS = ('archive.ubuntu.com', 'security.ubuntu.com', 'ports.ubuntu.com',
+                         'deb.debian.org', 'security.debian.org', 'httpredir.debian.org')
+
+# Build containers on docker's bridge networks. Not localhost: behind a
+# reverse proxy on the same host, every client would come from there.
+DEFAULT_CLIENT_NETWORKS = ('172.16.0.0/12',)
+
+# Files in the pool never change once published, so they can be cached
+CACHEABLE_SUFFIXES = ('.deb', '.udeb', '.dsc', '.tar.gz', '.tar.xz', '.tar.bz2', '.diff.gz')
+
+
+class NotProxied(Exception):
+    pass
+
+
+def proxied_url(url, proxy_url=None):
+    """Rewrite an http archive url to go through the package proxy"""
+    proxy_url = proxy_url or getattr(settings, 'BUILDSVC_APT_PROXY_URL', None)
+    parsed = urlparse(url)
+    if not proxy_url or parsed.scheme != 'http':
+        return url
+    return '%s/%s%s' % (proxy_url.rstrip('/'), parsed.netloc, parsed.path)
+
+
+def _ipv4_to_int(address):
+    return struct.unpack('!I', socket.inet_aton(address))[0]
+
+
+def in_networks(address, networks):
+    """Whether the IPv4 address is in any of networks (in CIDR notation)"""
+    try:
+        address = _ipv4_to_int(address)
+    except (socket.error, TypeError, ValueError):
+        return False
+
+    for network in networks:
+        base, _, bits = network.partition('/')
+        mask = (0xffffffff << (32 - int(bits or 32))) & 0xffffffff
+        if address & mask == _ipv4_to_int(base) & mask:
+            return True
+    return False
+
+
+def is_build_client(address, networks=None):
+    """Whether address is on a network the build containers run on"""
+    if networks is None:
+        networks = getattr(settings, 'MIRRORSVC_PROXY_CLIENT_NETWORKS', DEFAULT_CLIENT_NETWORKS)
+    return in_networks(address, networks)
+
+
+class PackageProxy(object):
+    """Serves apt requests for upstream archives to build containers
+
+    Requests are served from a local Mirror of the archive if there is
+    one. Otherwise they're fetched from upstream, and pool files are kept
+    in a cache on disk that is trimmed to its size budget, least recently
+    used first.
+
+    Only allowed_hosts are ever fetched from. Mirrors can point anywhere
+    and anyone can create one, so hosts only known from a Mirror are
+    served from the local mirror tree and nothing else."""
+
+    def __init__(self, cachedir=None, max_bytes=None, allowed_hosts=None):
+        if cachedir is None:
+            cachedir = getattr(settings, 'MIRRORSVC_PROXY_CACHE_DIR',
+                               os.path.join(settings.MIRRORSVC_BASE_PATH, 'proxy'))
+        if max_bytes is None:
+            max_bytes = getattr(settings, 'MIRRORSVC_PROXY_CACHE_MAX_BYTES', 10 * 1024 ** 3)
+        if allowed_hosts is None:
+            allowed_hosts = getattr(settings, 'MIRRORSVC_PROXY_ALLOWED_HOSTS', DEFAULT_ALLOWED_HOSTS)
+        self.cachedir = cachedir
+        self.max_bytes = max_bytes
+        self.allowed_hosts = allowed_hosts
+
+    def check(self, host, path):
+        # Empty segments would let an absolute path through os.path.join
+        if any(segment in ('', '.', '..') for segment in [host] + path.split('/')):
+            raise NotProxied('Invalid path')
+
+    def mirrors_for(self, host):
+        from .models import Mirror
+        return Mirror.objects.filter(url__startswith='http://%s/' % (host,))
+
+    def from_mirror(self, host, path):
+        """Path of the requested file in a local mirror, if we have it"""
+        for mirror in self.mirrors_for(host):
+            prefix = urlparse(mirror.url).path.strip('/')
+            if prefix and not path.startswith(prefix + '/'):
+                continue
+            local = self.resolve(mirror.archive_dir, path[len(prefix):].lstrip('/'))
+            if os.path.isfile(local):
+                return local
+
+    def resolve(self, basedir, *parts):
+        """Joins parts onto basedir, making sure the result stays under it"""
+        basedir = os.path.realpath(basedir)
+        resolved = os.path.realpath(os.path.join(basedir, *parts))
+        if not resolved.startswith(basedir + os.sep):
+            raise NotProxied('Invalid path')
+        return resolved
+
+    def cache_path(self, host, path):
+        return self.resolve(self.cachedir, host, path)
+
+    def is_cacheable(self, path):
+        return '/pool/' in '/%s' % (path,) and path.endswith(CACHEABLE_SUFFIXES)
+
+    def open(self, host, path):
+        """Returns a file object for the requested file, and its size if known
+
+        Raises NotProxied if the file can't be served."""
+        self.check(host, path)
+
+        local = self.from_mirror(host, path)
+        if local:
+            return open(local, 'rb'), os.path.getsize(local)
+
+        if host not in self.allowed_hosts:
+            raise NotProxied('%s is not proxied' % (host,))
+
+        if not self.is_cacheable(path):
+            return self.fetch(host, path)
+
+        cached = self.cache_path(host, path)
+        if os.path.isfile(cached):
+            os.utime(cached, None)
+            return open(cached, 'rb'), os.path.getsize(cached)
+
+        upstream, size = self.fetch(host, path)
+        try:
+            self.store(cached, upstream)
+        finally:
+            upstream.close()
+        self.evict(keep=cached)
+        return open(cached, 'rb'), os.path.getsize(cached)
+
+    def fetch(self, host, path):
+        url = 'http://%s/%s' % (host, path)
+        try:
+            fp = urlopen(url, timeout=getattr(settings, 'MIRRORSVC_PROXY_TIMEOUT', 60))
+        except (HTTPError, URLError) as e:
+            LOG.info('Failed to fetch %s: %s' % (url, e))
+            raise NotProxied(str(e))
+
+        size = fp.info().get('Content-Length')
+        return fp, size and int(size)
+
+    def store(self, path, fp):
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        fd, tmppath = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(fp, out)
+            os.rename(tmppath, path)
+        except Exception:
+            os.unlink(tmppath)
+            raise
+
+    def entries(self):
+        for root, dirs, files in os.walk(self.cachedir):
+            for f in files:
+                if not f.startswith('.tmp'):
+                    yield os.path.join(root, f)
+
+    def evict(self, keep=None):
+        """Remove least recently used files until we're within budget
+
+        Returns the number of bytes freed."""
+        entries = []
+        for path in self.entries():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, path, st.st_size))
+        total = sum(size for mtime, path, size in entries)
+
+        freed = 0
+        for mtime, path, size in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            freed += size
+
+        return freed
@@ -1,9 +1,16 @@
+import io
+import os
+import os.path
+import shutil
+import tempfile
+
 from django.contrib.auth import models as auth_models
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 import mock
 
 from .models import Mirror, MirrorSet, Snapshot
+from .proxy import NotProxied, PackageProxy, in_networks, proxied_url
 
 
 class SnapshotTestCase(TestCase):
@@ -46,3 +53,99 @@ class TaskTestCase(TestCase):
 
         SnapshotMock.objects.get.assert_called_with(id=1234)
         SnapshotMock.objects.get.return_value.perform_snapshot.assert_called_with()
+
+
+class FakeUpstreamResponse(io.BytesIO):
+    def info(self):
+        return {'Content-Length': str(len(self.getvalue()))}
+
+
+class PackageProxyTestCase(TestCase):
+    def setUp(self):
+        super(PackageProxyTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.proxy = PackageProxy(os.path.join(self.tmpdir, 'proxy'), max_bytes=1024)
+
+    def write(self, path, contents):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(contents)
+
+    def test_proxied_url(self):
+        self.assertEquals(proxied_url('http://archive.ubuntu.com/ubuntu', 'http://proxy:8000/mirrorsvc/apt-proxy/'),
+                          'http://proxy:8000/mirrorsvc/apt-proxy/archive.ubuntu.com/ubuntu')
+        self.assertEquals(proxied_url('https://example.com/ubuntu', 'http://proxy:8000/mirrorsvc/apt-proxy'),
+                          'https://example.com/ubuntu')
+        self.assertEquals(proxied_url('http://archive.ubuntu.com/ubuntu', None), 'http://archive.ubuntu.com/ubuntu')
+
+    def test_refuses_unknown_hosts_and_bad_paths(self):
+        self.assertRaises(NotProxied, self.proxy.open, 'example.com', 'ubuntu/pool/foo.deb')
+        self.assertRaises(NotProxied, self.proxy.open, 'archive.ubuntu.com', 'ubuntu/../../etc/passwd')
+        self.assertRaises(NotProxied, self.proxy.open, 'archive.ubuntu.com', '/srv/ubuntu/pool/foo.deb')
+        self.assertRaises(NotProxied, self.proxy.open, 'archive.ubuntu.com', 'ubuntu//pool/foo.deb')
+        self.assertRaises(NotProxied, self.proxy.open, '..', 'ubuntu/pool/foo.deb')
+        self.assertRaises(NotProxied, self.proxy.cache_path, 'archive.ubuntu.com', '/srv/ubuntu/pool/foo.deb')
+
+    @mock.patch('aasemble.django.apps.mirrorsvc.proxy.urlopen')
+    def test_never_fetches_from_mirror_hosts(self, urlopen):
+        user = auth_models.User.objects.create(username='testuser')
+        with override_settings(MIRRORSVC_BASE_PATH=self.tmpdir):
+            Mirror.objects.create(owner=user, url='http://10.0.0.1/ubuntu', series='trusty', components='main')
+            self.assertRaises(NotProxied, self.proxy.open, '10.0.0.1', 'ubuntu/dists/trusty/Release')
+            self.assertFalse(urlopen.called)
+
+    def test_in_networks(self):
+        self.assertTrue(in_networks('172.17.0.2', ['127.0.0.0/8', '172.16.0.0/12']))
+        self.assertTrue(in_networks('127.0.0.1', ['127.0.0.1']))
+        self.assertFalse(in_networks('192.168.1.1', ['127.0.0.0/8', '172.16.0.0/12']))
+        self.assertFalse(in_networks('::1', ['127.0.0.0/8']))
+        self.assertFalse(in_networks(None, ['127.0.0.0/8']))
+
+    def test_refuses_clients_off_the_build_network(self):
+        response = self.client.get('/mirrorsvc/apt-proxy/archive.ubuntu.com/ubuntu/pool/main/f/foo/foo_1.0_all.deb',
+                                   REMOTE_ADDR='203.0.113.5')
+        self.assertEquals(response.status_code, 403)
+
+        response = self.client.get('/mirrorsvc/apt-proxy/archive.ubuntu.com/ubuntu/pool/main/f/foo/foo_1.0_all.deb',
+                                   REMOTE_ADDR='127.0.0.1')
+        self.assertEquals(response.status_code, 403)
+
+    def test_serves_from_mirror(self):
+        user = auth_models.User.objects.create(username='testuser')
+        with override_settings(MIRRORSVC_BASE_PATH=self.tmpdir):
+            mirror = Mirror.objects.create(owner=user, url='http://archive.ubuntu.com/ubuntu', series='trusty', components='main')
+            self.write(os.path.join(mirror.archive_dir, 'pool', 'main', 'f', 'foo', 'foo_1.0_all.deb'), 'foo')
+            with mock.patch('aasemble.django.apps.mirrorsvc.proxy.urlopen') as urlopen:
+                response = self.client.get('/mirrorsvc/apt-proxy/archive.ubuntu.com/ubuntu/pool/main/f/foo/foo_1.0_all.deb',
+                                           REMOTE_ADDR='172.17.0.2')
+                self.assertEquals(b''.join(response.streaming_content), b'foo')
+                self.assertFalse(urlopen.called)
+
+    @mock.patch('aasemble.django.apps.mirrorsvc.proxy.urlopen')
+    def test_caches_pool_files(self, urlopen):
+        urlopen.side_effect = lambda url, timeout: FakeUpstreamResponse(b'foo')
+        for i in range(2):
+            fp, size = self.proxy.open('archive.ubuntu.com', 'ubuntu/pool/main/f/foo/foo_1.0_all.deb')
+            self.assertEquals(fp.read(), b'foo')
+            fp.close()
+        self.assertEquals(urlopen.call_count, 1)
+
+    @mock.patch('aasemble.django.apps.mirrorsvc.proxy.urlopen')
+    def test_does_not_cache_indexes(self, urlopen):
+        urlopen.side_effect = lambda url, timeout: FakeUpstreamResponse(b'Packages')
+        for i in range(2):
+            fp, size = self.proxy.open('archive.ubuntu.com', 'ubuntu/dists/trusty/main/binary-amd64/Packages.gz')
+            self.assertEquals(size, 8)
+        self.assertEquals(urlopen.call_count, 2)
+
+    @mock.patch('aasemble.django.apps.mirrorsvc.proxy.urlopen')
+    def test_evicts_least_recently_used(self, urlopen):
+        urlopen.side_effect = lambda url, timeout: FakeUpstreamResponse(b'x' * 600)
+        self.proxy.open('archive.ubuntu.com', 'ubuntu/pool/main/a/a/a_1.0_all.deb')[0].close()
+        old = self.proxy.cache_path('archive.ubuntu.com', 'ubuntu/pool/main/a/a/a_1.0_all.deb')
+        os.utime(old, (0, 0))
+        self.proxy.open('archive.ubuntu.com', 'ubuntu/pool/main/b/b/b_1.0_all.deb')[0].close()
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(self.proxy.cache_path('archive.ubuntu.com', 'ubuntu/pool/main/b/b/b_1.0_all.deb')))
@@ -14,4 +14,5 @@ urlpatterns = [
     url(r'^mirrorsets/(?P<uuid>[^/]+)/snapshots/$', aasemble.django.apps.mirrorsvc.views.mirrorset_snapshots, name='mirrorset_snapshots'),
     url(r'^mirrorsets/(?P<uuid>[^/]+)/snapshots/new', aasemble.django.apps.mirrorsvc.views.create_new_snapshot, name='new_snapshot'),
     url(r'^mirrorsets/', aasemble.django.apps.mirrorsvc.views.mirrorsets, name='mirrorsets'),
+    url(r'^apt-proxy/(?P<host>[^/]+)/(?P<path>.+)$', aasemble.django.apps.mirrorsvc.views.apt_proxy, name='apt_proxy'),
 ]
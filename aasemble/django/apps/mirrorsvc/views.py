@@ -1,10 +1,13 @@
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.http import FileResponse, Http404, HttpResponseRedirect
 from django.shortcuts import render
+from django.views.decorators.http import require_safe
 
 from .forms import MirrorDefinitionForm, MirrorSetDefinitionForm
 from .models import Mirror, MirrorSet, Snapshot
+from .proxy import NotProxied, PackageProxy, is_build_client
 
 
 def get_mirror_definition_form(request, *args, **kwargs):
@@ -129,3 +132,20 @@ def create_new_snapshot(request, uuid):
         snap = Snapshot.objects.create(mirrorset=ms)
         snap.perform_snapshot()
     return HttpResponseRedirect(reverse('mirrorsvc:mirrorset_snapshots', kwargs={'uuid': uuid}))
+
+
+@require_safe
+def apt_proxy(request, host, path):
+    """Package proxy for build containers. See PackageProxy"""
+    if not (request.user.is_authenticated() or is_build_client(request.META.get('REMOTE_ADDR'))):
+        raise PermissionDenied
+
+    try:
+        fp, size = PackageProxy().open(host, path)
+    except NotProxied:
+        raise Http404
+
+    response = FileResponse(fp, content_type='application/octet-stream')
+    if size:
+        response['Content-Length'] = size
+    return response
@@ -129,6 +129,14 @@ CELERYBEAT_SCHEDULE = {
         'task': 'aasemble.django.apps.buildsvc.tasks.poll_all',
         'schedule': timedelta(seconds=10),
     },
+    'dispatch-builds': {
+        'task': 'aasemble.django.apps.buildsvc.tasks.dispatch_builds',
+        'schedule': timedelta(seconds=10),
+    },
+    'prune-builds': {
+        'task': 'aasemble.django.apps.buildsvc.tasks.prune_builds',
+        'schedule': timedelta(hours=6),
+    },
 }
 
 CELERY_TIMEZONE = TIME_ZONE